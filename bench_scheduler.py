@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк планировщика и хранилища Napominalkin Bot
+
+Генерирует N синтетических напоминаний в формате handle_web_app_data и измеряет
+время загрузки хранилища, такта check_reminders, мутаций Database и пиковое
+потребление памяти. Каждый размер запускается в отдельном процессе, чтобы
+пиковый RSS не смешивался между прогонами.
+
+    python bench_scheduler.py --sizes 1000 10000 100000 1000000 --output bench.json
+    python bench_scheduler.py --render 100000   # стоимость сборки текстов сообщений
+"""
+
+import argparse
+import asyncio
+import datetime
+import itertools
+import json
+import logging
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# Лимит памяти контейнера из docker-compose.yml
+MEMORY_BUDGET_MB = 256
+DEFAULT_SIZES = [1000, 10000, 100000, 1000000]
+
+# Популярные времена, к которым тяготеет большинство напоминаний
+POPULAR_TIMES = [(9, 0), (8, 0), (10, 0), (12, 0), (18, 0), (20, 0), (21, 0), (7, 30)]
+REPEATS = ['none', 'daily', 'weekly', 'custom']
+REPEAT_WEIGHTS = [40, 35, 15, 10]
+
+
+def generate_reminders(count, users=None, now=None, due_share=0.01, seed=42):
+    """Генерирует (лениво) напоминания в формате, который сохраняет handle_web_app_data"""
+    rng = random.Random(seed)
+    now = now or datetime.datetime.now().replace(second=0, microsecond=0)
+    users = users or max(count // 20, 1)
+    for i in range(count):
+        if rng.random() < due_share:
+            # Эти напоминания должны сработать в измеряемый такт
+            when = now
+        elif rng.random() < 0.7:
+            hour, minute = rng.choice(POPULAR_TIMES)
+            when = (now + datetime.timedelta(days=rng.randint(1, 30))).replace(hour=hour, minute=minute)
+        else:
+            when = now + datetime.timedelta(minutes=rng.randint(1, 60 * 24 * 30))
+        repeat = rng.choices(REPEATS, REPEAT_WEIGHTS)[0]
+        yield {
+            'text': f'Синтетическое напоминание #{i}',
+            'datetime': when.isoformat(),
+            'repeat': repeat,
+            'days': sorted(rng.sample(range(7), rng.randint(1, 5))) if repeat == 'custom' else None,
+            'user_id': 100000 + rng.randrange(users),
+            'id': i + 1,
+            'created_at': (now - datetime.timedelta(days=1)).isoformat(),
+            'active': True,
+        }
+
+
+def write_sqlite_db(path, count, batch_size=10000):
+    """Заполняет SQLite-базу пачками, не держа все напоминания в памяти (и без миграции из JSON)"""
+    from models import Reminder
+    from storage import SqliteStorage
+
+    storage = SqliteStorage(path)
+    reminders = generate_reminders(count)
+    while True:
+        batch = [Reminder.from_dict(data) for data in itertools.islice(reminders, batch_size)]
+        if not batch:
+            break
+        storage.save_reminders(batch, next_id=count + 1)
+    storage.close()
+
+
+def write_reminders_file(path, count):
+    """Пишет reminders.json потоково, не держа все напоминания в памяти"""
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(f'{{"next_id": {count + 1}, "reminders": [')
+        for i, reminder in enumerate(generate_reminders(count)):
+            if i:
+                f.write(', ')
+            f.write(json.dumps(reminder, ensure_ascii=False))
+        f.write(']}')
+
+
+class StubBot:
+    """Заглушка Bot API: мгновенно «отправляет» сообщения"""
+
+    def __init__(self):
+        self.sent = 0
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.sent += 1
+
+
+def peak_rss_mb():
+    # На Linux ru_maxrss в килобайтах
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_single(size, backend, workdir):
+    """Прогон одного размера в текущем процессе"""
+    os.chdir(workdir)
+    os.environ.setdefault('BOT_TOKEN', '123456:BENCH')
+    os.environ['STORAGE_BACKEND'] = backend
+
+    # main.py при импорте создаёт свою (пока пустую) базу в рабочей директории
+    import main
+    from delivery import DeliveryQueue
+    from storage import SQLITE_PATH, create_storage
+    logging.getLogger().setLevel(logging.WARNING)
+
+    if backend == 'sqlite':
+        write_sqlite_db(SQLITE_PATH, size)
+    else:
+        write_reminders_file('reminders.json', size)
+        # Журнал прошлого запуска относится к другому снимку
+        if os.path.exists('reminders.json.journal'):
+            os.remove('reminders.json.journal')
+    baseline_rss = peak_rss_mb()
+
+    storage = create_storage(backend)
+    started = time.perf_counter()
+    db = main.Database(scheduler=main.reminder_scheduler, storage=storage)
+    load_time = time.perf_counter() - started
+    main.db = db
+
+    stub = StubBot()
+    main.delivery_queue = DeliveryQueue(stub.send_message, workers=8, global_rate=1e9, chat_rate=1e9,
+                                        dead_letter_file=None)
+
+    async def measure():
+        # Как и в боте, JSON-хранилище пишет на диск из фоновой задачи
+        flusher = asyncio.create_task(db.storage.run_flusher())
+        await asyncio.sleep(0)
+
+        started = time.perf_counter()
+        await main.check_reminders()
+        tick_time = time.perf_counter() - started
+        await main.delivery_queue.stop()
+
+        when = (datetime.datetime.now() + datetime.timedelta(days=1)).isoformat()
+        mutations = {'add': [], 'toggle': [], 'delete': []}
+        for i in range(200):
+            user_id = 900000 + i
+            started = time.perf_counter()
+            reminder = db.add_reminder({'text': 'Бенчмарк', 'datetime': when, 'repeat': 'daily', 'days': None,
+                                        'user_id': user_id})
+            mutations['add'].append(time.perf_counter() - started)
+            started = time.perf_counter()
+            db.toggle_reminder(reminder['id'], user_id)
+            mutations['toggle'].append(time.perf_counter() - started)
+            started = time.perf_counter()
+            db.delete_reminder(reminder['id'], user_id)
+            mutations['delete'].append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        db.storage.stop_flusher()
+        await flusher
+        db.storage.close()
+        flush_time = time.perf_counter() - started
+        return tick_time, mutations, flush_time
+
+    tick_time, mutations, flush_time = asyncio.run(measure())
+
+    rss = peak_rss_mb()
+    return {
+        'size': size,
+        'backend': backend,
+        'load_time_s': round(load_time, 4),
+        'tick_time_s': round(tick_time, 4),
+        'flush_time_s': round(flush_time, 4),
+        'due_reminders': stub.sent,
+        'mutation_latency_ms': {name: round(sum(values) / len(values) * 1000, 4) for name, values in mutations.items()},
+        'peak_rss_mb': round(rss, 1),
+        'store_rss_mb': round(rss - baseline_rss, 1),
+        'within_memory_budget': rss <= MEMORY_BUDGET_MB,
+    }
+
+
+def bench_render(count):
+    """Среднее время сборки уведомления, подтверждения и карточки списка, в микросекундах"""
+    from models import Reminder
+    from rendering import render_card, render_confirmation, render_notification
+
+    reminders = [Reminder.from_dict(data) for data in generate_reminders(count)]
+    users = [{'first_name': f'Пользователь {i % 1000}'} for i in range(count)]
+    results = {}
+    for name, render in (('notification', lambda r, u: render_notification(r, u)),
+                         ('confirmation', lambda r, u: render_confirmation(r)),
+                         ('card', lambda r, u: render_card(1, r))):
+        started = time.perf_counter()
+        for reminder, user in zip(reminders, users):
+            render(reminder, user)
+        results[name] = round((time.perf_counter() - started) / count * 1e6, 3)
+    return results
+
+
+def compare(baseline_path, results):
+    """Печатает изменение метрик относительно предыдущего прогона"""
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = {(r['size'], r['backend']): r for r in json.load(f)['results']}
+    for result in results:
+        previous = baseline.get((result['size'], result['backend']))
+        if previous is None:
+            continue
+        changes = []
+        for metric in ('load_time_s', 'tick_time_s', 'peak_rss_mb'):
+            if previous[metric]:
+                changes.append(f"{metric} {(result[metric] / previous[metric] - 1) * 100:+.1f}%")
+        print(f"📊 {result['size']}: " + ', '.join(changes))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Napominalkin scheduler benchmark')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES)
+    parser.add_argument('--backend', choices=['json', 'sqlite'], default='json')
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument('--baseline', help='JSON с результатами предыдущей версии для сравнения')
+    parser.add_argument('--check-budget', action='store_true',
+                        help=f'завершиться с ошибкой, если пиковый RSS превысил {MEMORY_BUDGET_MB} МБ')
+    parser.add_argument('--render', type=int, metavar='N',
+                        help='только микробенчмарк сборки сообщений на N напоминаниях')
+    parser.add_argument('--single', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.render:
+        for name, microseconds in bench_render(args.render).items():
+            print(f"✉️  {name}: {microseconds} мкс на сообщение")
+        return
+
+    if args.single:
+        with tempfile.TemporaryDirectory() as workdir:
+            print(json.dumps(run_single(args.single, args.backend, workdir)))
+        return
+
+    results = []
+    for size in args.sizes:
+        print(f"⏱️  {size} напоминаний ({args.backend})...", flush=True)
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--single', str(size), '--backend', args.backend],
+            check=True, capture_output=True, text=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        results.append(result)
+        print(f"   загрузка {result['load_time_s']} с, такт {result['tick_time_s']} с "
+              f"({result['due_reminders']} к отправке), пик RSS {result['peak_rss_mb']} МБ")
+
+    report = {
+        'generated_at': datetime.datetime.now().isoformat(),
+        'python': sys.version.split()[0],
+        'memory_budget_mb': MEMORY_BUDGET_MB,
+        'results': results,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"📄 Результаты записаны в {args.output}")
+
+    if args.baseline:
+        compare(args.baseline, results)
+
+    if args.check_budget and not all(r['within_memory_budget'] for r in results):
+        print(f"❌ Превышен бюджет памяти {MEMORY_BUDGET_MB} МБ")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+"""
+Массовый импорт и экспорт напоминаний в JSONL и CSV
+
+Файл читается потоково и вставляется пачками по IMPORT_BATCH_SIZE (одна транзакция
+SQLite или одна запись JSON-файла на пачку). Экспорт пишется построчно.
+
+    python bulk.py import reminders.jsonl [--user-id 123]
+    python bulk.py export backup.csv [--user-id 123] [--format csv]
+"""
+
+import argparse
+import codecs
+import csv
+import datetime
+import html
+import json
+import os
+import sys
+
+from recurrence import REPEAT_TYPES, is_valid_timezone
+
+IMPORT_BATCH_SIZE = int(os.getenv('IMPORT_BATCH_SIZE', 1000))
+# Пользователи Telegram, которым доступен экспорт всех напоминаний (/export all)
+ADMIN_IDS = {int(user_id) for user_id in os.getenv('ADMIN_IDS', '').replace(',', ' ').split()}
+FORMATS = ('jsonl', 'csv')
+EXPORT_FIELDS = ('id', 'user_id', 'text', 'datetime', 'timezone', 'repeat', 'days', 'active')
+MAX_TEXT_LENGTH = 1000
+# Ограничения для пользователей не из ADMIN_IDS: сколько напоминаний можно загрузить
+# одним файлом и сколько всего может быть у одного пользователя
+MAX_IMPORT_RECORDS = int(os.getenv('MAX_IMPORT_RECORDS', 1000))
+MAX_USER_REMINDERS = int(os.getenv('MAX_USER_REMINDERS', 5000))
+# Сколько ошибок валидации показывать пользователю
+MAX_REPORTED_ERRORS = 10
+
+
+class ImportResult:
+    def __init__(self):
+        self.imported = 0
+        self.errors = []  # (номер строки, описание ошибки)
+        self.stopped = None  # (номер строки, причина), если файл дочитан не до конца
+
+    def add_error(self, line, error):
+        self.errors.append((line, str(error)))
+
+
+def detect_format(filename):
+    """Формат файла по расширению: csv или jsonl (по умолчанию)"""
+    return 'csv' if filename and filename.lower().endswith('.csv') else 'jsonl'
+
+
+def read_records(stream, fmt):
+    """Лениво читает записи (номер строки, словарь) из текстового потока"""
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for record in reader:
+            yield reader.line_num, record
+        return
+    if fmt != 'jsonl':
+        raise ValueError(f"Unknown format: {fmt}")
+    for line_number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            yield line_number, json.loads(line)
+        except json.JSONDecodeError as e:
+            yield line_number, ValueError(f"invalid JSON: {e.msg}")
+
+
+def _parse_days(value):
+    if value in (None, ''):
+        return None
+    if isinstance(value, str):
+        value = value.replace(';', ' ').replace(',', ' ').split()
+    try:
+        days = sorted({int(day) for day in value})
+    except (TypeError, ValueError):
+        raise ValueError("days must be a list of weekday numbers 0-6")
+    if any(day < 0 or day > 6 for day in days):
+        raise ValueError("days must be weekday numbers 0-6 (0 - Sunday)")
+    return days or None
+
+
+def _parse_bool(value):
+    if isinstance(value, bool):
+        return value
+    if value in (None, ''):
+        return True
+    return str(value).strip().lower() not in ('0', 'false', 'no')
+
+
+def validate_record(record, user_id=None):
+    """Проверяет запись импорта и приводит её к формату напоминания.
+
+    user_id задаёт владельца всех записей (загрузка файла пользователем);
+    иначе он берётся из самой записи. ValueError, если запись некорректна.
+    """
+    if isinstance(record, Exception):
+        raise record
+    if not isinstance(record, dict):
+        raise ValueError("record must be an object")
+
+    text = record.get('text')
+    if not isinstance(text, str) or not text.strip():
+        raise ValueError("text is required")
+    if len(text) > MAX_TEXT_LENGTH:
+        raise ValueError(f"text is longer than {MAX_TEXT_LENGTH} characters")
+
+    try:
+        when = datetime.datetime.fromisoformat(str(record.get('datetime') or '').replace('Z', '+00:00'))
+    except ValueError:
+        raise ValueError("datetime must be in ISO format, e.g. 2024-05-01T09:00")
+
+    repeat = record.get('repeat') or 'none'
+    if repeat not in REPEAT_TYPES:
+        raise ValueError(f"repeat must be one of {', '.join(REPEAT_TYPES)}")
+    days = _parse_days(record.get('days'))
+    if repeat == 'custom' and not days:
+        raise ValueError("custom repeat requires days")
+
+    timezone = record.get('timezone') or None
+    if timezone is not None and not is_valid_timezone(timezone):
+        raise ValueError(f"unknown timezone: {timezone}")
+
+    if user_id is None:
+        try:
+            user_id = int(record.get('user_id'))
+        except (TypeError, ValueError):
+            raise ValueError("user_id is required")
+
+    reminder = {
+        'text': text.strip(),
+        'datetime': when.isoformat(),
+        'repeat': repeat,
+        'days': days,
+        'user_id': user_id,
+        'active': _parse_bool(record.get('active')),
+    }
+    if timezone is not None:
+        reminder['timezone'] = timezone
+    return reminder
+
+
+def import_reminders(db, stream, fmt, user_id=None, batch_size=IMPORT_BATCH_SIZE, limit=None):
+    """Импортирует напоминания из потока пачками; некорректные строки пропускаются.
+
+    Не больше limit напоминаний (None - без ограничения). Если файл не читается
+    (не UTF-8, испорченный CSV), импорт останавливается, а уже записанные пачки остаются.
+    """
+    result = ImportResult()
+    batch = []
+    records = read_records(stream, fmt)
+    line_number = 0
+    while True:
+        try:
+            line_number, record = next(records)
+        except StopIteration:
+            break
+        except UnicodeDecodeError:
+            result.stopped = (line_number + 1, "file is not valid UTF-8")
+            break
+        except csv.Error as e:
+            result.stopped = (line_number + 1, f"invalid CSV: {e}")
+            break
+        try:
+            reminder = validate_record(record, user_id)
+        except ValueError as e:
+            result.add_error(line_number, e)
+            continue
+        if limit is not None and result.imported + len(batch) >= limit:
+            result.stopped = (line_number, f"limit of {limit} reminders reached")
+            break
+        batch.append(reminder)
+        if len(batch) >= batch_size:
+            db.add_reminders(batch)
+            result.imported += len(batch)
+            batch = []
+    if batch:
+        db.add_reminders(batch)
+        result.imported += len(batch)
+    return result
+
+
+def export_record(reminder):
+    data = reminder.to_dict()
+    return {field: data.get(field) for field in EXPORT_FIELDS}
+
+
+def write_export(reminders, stream, fmt):
+    """Построчно пишет напоминания в поток; возвращает их количество"""
+    count = 0
+    if fmt == 'csv':
+        writer = csv.DictWriter(stream, fieldnames=EXPORT_FIELDS)
+        writer.writeheader()
+        for reminder in reminders:
+            record = export_record(reminder)
+            record['days'] = ','.join(str(day) for day in record['days'] or ())
+            writer.writerow(record)
+            count += 1
+    elif fmt == 'jsonl':
+        for reminder in reminders:
+            stream.write(json.dumps(export_record(reminder), ensure_ascii=False) + '\n')
+            count += 1
+    else:
+        raise ValueError(f"Unknown format: {fmt}")
+    return count
+
+
+def format_import_report(result):
+    """Текст отчёта об импорте для пользователя"""
+    lines = [f"📥 Импортировано напоминаний: <b>{result.imported}</b>"]
+    if result.errors:
+        lines.append(f"⚠️ Пропущено строк с ошибками: <b>{len(result.errors)}</b>")
+        for line_number, error in result.errors[:MAX_REPORTED_ERRORS]:
+            lines.append(f"• строка {line_number}: {html.escape(error)}")
+        if len(result.errors) > MAX_REPORTED_ERRORS:
+            lines.append("• …")
+    if result.stopped:
+        line_number, reason = result.stopped
+        lines.append(f"⛔ Импорт остановлен на строке {line_number}: {html.escape(reason)}")
+    return "\n".join(lines)
+
+
+def open_text(binary):
+    """Строки загруженного файла (UTF-8, с BOM или без).
+
+    Декодируется каждая строка отдельно, поэтому ошибка кодировки приходится
+    ровно на ту строку, где она есть, а не на блок из нескольких килобайт.
+    """
+    decoder = codecs.getincrementaldecoder('utf-8-sig')()
+    for line in binary:
+        yield decoder.decode(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Napominalkin bulk import/export')
+    parser.add_argument('command', choices=['import', 'export'])
+    parser.add_argument('path')
+    parser.add_argument('--user-id', type=int, help='владелец импортируемых напоминаний / экспорт одного пользователя')
+    parser.add_argument('--format', choices=FORMATS, help='по умолчанию определяется по расширению файла')
+    args = parser.parse_args()
+    fmt = args.format or detect_format(args.path)
+
+    # main.py при импорте настраивает логирование и загружает хранилище из окружения (.env)
+    os.environ.setdefault('BOT_TOKEN', '0:CLI')
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from main import db
+
+    try:
+        if args.command == 'import':
+            with open(args.path, encoding='utf-8-sig', newline='') as f:
+                result = import_reminders(db, f, fmt, args.user_id)
+            for line_number, error in result.errors:
+                print(f"line {line_number}: {error}", file=sys.stderr)
+            if result.stopped:
+                line_number, reason = result.stopped
+                print(f"stopped at line {line_number}: {reason}", file=sys.stderr)
+            print(f"Imported {result.imported} reminders, skipped {len(result.errors)}")
+        else:
+            with open(args.path, 'w', encoding='utf-8', newline='') as f:
+                count = write_export(db.iter_reminders(args.user_id), f, fmt)
+            print(f"Exported {count} reminders to {args.path}")
+    finally:
+        db.storage.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,256 @@
+import asyncio
+import collections
+import json
+import logging
+import os
+import time
+
+from aiogram.exceptions import (TelegramAPIError, TelegramNetworkError, TelegramRetryAfter,
+                                TelegramServerError)
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Лимиты Bot API: ~30 сообщений в секунду всего и ~1 сообщение в секунду в один чат
+DELIVERY_WORKERS = int(os.getenv('DELIVERY_WORKERS', 8))
+GLOBAL_RATE = float(os.getenv('DELIVERY_GLOBAL_RATE', 25))
+CHAT_RATE = float(os.getenv('DELIVERY_CHAT_RATE', 1))
+CHAT_BURST = int(os.getenv('DELIVERY_CHAT_BURST', 3))
+MAX_RETRIES = int(os.getenv('DELIVERY_MAX_RETRIES', 3))
+RETRY_BACKOFF = float(os.getenv('DELIVERY_RETRY_BACKOFF', 1))
+DEAD_LETTER_FILE = os.getenv('DEAD_LETTER_FILE', 'dead_letters.jsonl')
+
+# Ошибки, после которых имеет смысл повторить отправку
+TRANSIENT_ERRORS = (TelegramNetworkError, TelegramServerError, asyncio.TimeoutError, OSError)
+
+
+class TokenBucket:
+    """Ведро токенов: rate токенов в секунду, не больше capacity в запасе"""
+
+    def __init__(self, rate, capacity=None, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1)
+        self.tokens = self.capacity
+        self.clock = clock
+        self.updated = clock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self):
+        """Сколько секунд ждать до появления токена (0 - можно отправлять)"""
+        self._refill()
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self):
+        self._refill()
+        self.tokens -= 1
+
+    def is_idle(self):
+        self._refill()
+        return self.tokens >= self.capacity
+
+    async def acquire(self):
+        while True:
+            delay = self.delay()
+            if delay <= 0:
+                self.consume()
+                return
+            await asyncio.sleep(delay)
+
+
+class DeliveryJob:
+    __slots__ = ('chat_id', 'text', 'kwargs', 'attempt', 'created_at', 'scheduled_at')
+
+    def __init__(self, chat_id, text, kwargs, scheduled_at=None):
+        self.chat_id = chat_id
+        self.text = text
+        self.kwargs = kwargs
+        self.attempt = 0
+        self.created_at = time.time()
+        # Время, на которое было запланировано напоминание (для метрики опоздания)
+        self.scheduled_at = scheduled_at
+
+
+class DeliveryQueue:
+    """Очередь отправки сообщений с пулом воркеров и ограничением скорости.
+
+    send - корутина send(chat_id, text, **kwargs), обычно bot.send_message.
+    Если лимит чата исчерпан, сообщение откладывается, а воркер берёт
+    следующее, так что один «шумный» чат не задерживает остальных.
+    """
+
+    def __init__(self, send, workers=DELIVERY_WORKERS, global_rate=GLOBAL_RATE, chat_rate=CHAT_RATE,
+                 chat_burst=CHAT_BURST, max_retries=MAX_RETRIES, retry_backoff=RETRY_BACKOFF,
+                 dead_letter_file=DEAD_LETTER_FILE):
+        self.send = send
+        self.workers = workers
+        self.global_bucket = TokenBucket(global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.dead_letter_file = dead_letter_file
+        self.dead_letters = collections.deque(maxlen=1000)
+        self.stats = collections.Counter()
+        self._chat_buckets = {}
+        self._queue = None
+        self._tasks = []
+        self._pending = 0
+        self._idle = None
+        # Отложенные сообщения (лимит чата, RetryAfter, повтор) и их таймеры
+        self._delayed = {}
+        self._paused_until = 0
+
+    def start(self):
+        if self._tasks:
+            return
+        self._queue = asyncio.Queue()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self, drain=True, timeout=10):
+        """Останавливает воркеры; при drain=True сначала ждёт отправки очереди (не дольше timeout)"""
+        if drain and self._tasks:
+            try:
+                await asyncio.wait_for(self.join(), timeout)
+            except asyncio.TimeoutError:
+                logger.warning("Delivery queue stopped with %s undelivered messages", self._pending)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._drop_undelivered()
+
+    async def join(self):
+        if self._idle is not None:
+            await self._idle.wait()
+
+    def __len__(self):
+        return self._pending
+
+    def submit(self, chat_id, text, scheduled_at=None, **kwargs):
+        """Ставит сообщение в очередь отправки"""
+        if not self._tasks:
+            self.start()
+        self._pending += 1
+        self._idle.clear()
+        self._queue.put_nowait(DeliveryJob(chat_id, text, kwargs, scheduled_at))
+
+    def _requeue_later(self, job, delay):
+        self._delayed[job] = asyncio.get_running_loop().call_later(delay, self._release_delayed, job)
+
+    def _release_delayed(self, job):
+        del self._delayed[job]
+        self._queue.put_nowait(job)
+
+    def _drop_undelivered(self):
+        """Переносит неотправленные при остановке сообщения в dead letters и обнуляет счётчик.
+
+        Иначе после нового start() join() и stop() ждали бы их до таймаута.
+        """
+        dropped = []
+        while self._queue is not None and not self._queue.empty():
+            dropped.append(self._queue.get_nowait())
+        for job, handle in self._delayed.items():
+            handle.cancel()
+            dropped.append(job)
+        self._delayed = {}
+        for job in dropped:
+            self._dead_letter(job, RuntimeError("delivery queue stopped"))
+        # Сообщения, которые воркеры отправляли в момент отмены, тоже больше не ждём
+        self._pending = 0
+        if self._idle is not None:
+            self._idle.set()
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self._chat_buckets) > 10000:
+                # Забываем ведра чатов, которые давно ничего не получали
+                self._chat_buckets = {k: b for k, b in self._chat_buckets.items() if not b.is_idle()}
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    def _done(self):
+        self._pending -= 1
+        if self._pending == 0:
+            self._idle.set()
+
+    async def _worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            job = await self._queue.get()
+            # Пока действует RetryAfter или лимит чата исчерпан, откладываем сообщение
+            bucket = self._chat_bucket(job.chat_id)
+            delay = max(self._paused_until - loop.time(), bucket.delay())
+            if delay > 0:
+                self._requeue_later(job, delay)
+                continue
+            bucket.consume()
+            await self.global_bucket.acquire()
+            await self._deliver(job)
+
+    async def _deliver(self, job):
+        job.attempt += 1
+        started = time.perf_counter()
+        try:
+            await self.send(job.chat_id, job.text, **job.kwargs)
+        except TelegramRetryAfter as e:
+            # Telegram просит подождать: приостанавливаем всю отправку
+            loop = asyncio.get_running_loop()
+            self._paused_until = max(self._paused_until, loop.time() + e.retry_after)
+            self.stats['rate_limited'] += 1
+            logger.warning("Rate limited by Telegram, pausing delivery for %ss", e.retry_after)
+            job.attempt -= 1
+            self._requeue_later(job, e.retry_after)
+            return
+        except TRANSIENT_ERRORS as e:
+            if job.attempt <= self.max_retries:
+                self.stats['retried'] += 1
+                self._requeue_later(job, min(self.retry_backoff * 2 ** (job.attempt - 1), 60))
+                return
+            self._dead_letter(job, e)
+        except TelegramAPIError as e:
+            # Пользователь заблокировал бота, чат не найден и т.п. - повтор не поможет
+            self._dead_letter(job, e)
+        except Exception as e:
+            # Непредвиденная ошибка не должна останавливать обработчик: иначе сообщение
+            # навсегда осталось бы неотправленным, а stop() ждал бы его до таймаута
+            logger.exception("Unexpected error sending message to chat %s", job.chat_id)
+            self._dead_letter(job, e)
+        else:
+            self.stats['sent'] += 1
+            metrics.API_LATENCY.observe(time.perf_counter() - started)
+            metrics.MESSAGES_SENT.inc()
+            if job.scheduled_at is not None:
+                metrics.FIRE_LATENESS.observe(max(time.time() - job.scheduled_at, 0))
+            # Строка на каждое сообщение нужна только при отладке: сводка есть в логе планировщика
+            logger.debug("Sent message to chat %s", job.chat_id)
+        self._done()
+
+    def _dead_letter(self, job, error):
+        self.stats['failed'] += 1
+        metrics.MESSAGES_FAILED.inc()
+        record = {
+            'chat_id': job.chat_id,
+            'text': job.text,
+            'attempts': job.attempt,
+            'error': f"{type(error).__name__}: {error}",
+            'created_at': job.created_at,
+            'failed_at': time.time(),
+        }
+        self.dead_letters.append(record)
+        logger.error("Error sending message to chat %s: %s", job.chat_id, error)
+        if self.dead_letter_file:
+            try:
+                with open(self.dead_letter_file, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(record, ensure_ascii=False) + '\n')
+            except OSError as e:
+                logger.error("Error writing dead letter: %s", e)
@@ -0,0 +1,102 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+
+# Общий уровень и уровни отдельных компонентов (логгеров), например:
+#   LOG_LEVELS=scheduler=DEBUG,delivery=WARNING,aiogram.event=WARNING
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+LOG_LEVELS = os.getenv('LOG_LEVELS', '')
+# text - обычные строки, json - одна JSON-запись на строку (для сборщиков логов)
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'text')
+# Запись логов в отдельном потоке, чтобы вывод не блокировал цикл событий
+LOG_QUEUE = os.getenv('LOG_QUEUE', '1') not in ('0', 'false', 'no')
+
+TEXT_FORMAT = '%(asctime)s %(levelname)s %(name)s: %(message)s'
+
+# Стандартные атрибуты LogRecord; всё остальное - поля из extra
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+_listener = None
+_handler = None
+
+
+class JsonFormatter(logging.Formatter):
+    """Запись лога одной JSON-строкой; поля из extra попадают в неё как есть"""
+
+    def format(self, record):
+        payload = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and not key.startswith('_'):
+                payload[key] = value
+        if record.exc_info:
+            payload['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+def parse_levels(spec):
+    """Разбирает строку вида "scheduler=DEBUG,delivery=WARNING" в словарь"""
+    levels = {}
+    for item in spec.split(','):
+        name, sep, level = item.partition('=')
+        if not sep or not name.strip():
+            continue
+        levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def create_formatter(fmt=None):
+    fmt = fmt or LOG_FORMAT
+    if fmt == 'json':
+        return JsonFormatter()
+    if fmt == 'text':
+        return logging.Formatter(TEXT_FORMAT)
+    raise ValueError(f"Unknown log format: {fmt}")
+
+
+def setup_logging(level=None, levels=None, fmt=None, use_queue=None, stream=None):
+    """Настраивает корневой логгер: уровни компонентов, формат и фоновую запись.
+
+    Повторный вызов заменяет ранее установленный обработчик.
+    """
+    global _listener, _handler
+    use_queue = LOG_QUEUE if use_queue is None else use_queue
+    root = logging.getLogger()
+    shutdown_logging()
+
+    output = logging.StreamHandler(stream)
+    output.setFormatter(create_formatter(fmt))
+    if use_queue:
+        # QueueHandler только кладёт запись в очередь, вывод делает поток QueueListener
+        log_queue = queue.SimpleQueue()
+        _handler = logging.handlers.QueueHandler(log_queue)
+        _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+        _listener.start()
+    else:
+        _handler = output
+    root.addHandler(_handler)
+    root.setLevel(level or LOG_LEVEL)
+
+    for name, component_level in parse_levels(LOG_LEVELS if levels is None else levels).items():
+        logging.getLogger(name).setLevel(component_level)
+
+
+def shutdown_logging():
+    """Дописывает оставшиеся в очереди записи и снимает обработчик"""
+    global _listener, _handler
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+    if _handler is not None:
+        logging.getLogger().removeHandler(_handler)
+        _handler = None
+
+
+atexit.register(shutdown_logging)
@@ -1,88 +1,409 @@
 import os
 import logging
 import asyncio
+import itertools
 import json
 import datetime
+import signal
+import tempfile
+import time
+from aiohttp import web
 from aiogram import Bot, Dispatcher, types, F
 from aiogram.filters import Command
-from aiogram.types import WebAppInfo, ReplyKeyboardMarkup, KeyboardButton
+from aiogram.types import (WebAppInfo, ReplyKeyboardMarkup, KeyboardButton, FSInputFile, InlineKeyboardMarkup,
+                           InlineKeyboardButton)
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from aiogram.client.default import DefaultBotProperties
 from aiogram.enums import ParseMode
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
 from dotenv import load_dotenv
 
+import metrics
+from bulk import (ADMIN_IDS, MAX_IMPORT_RECORDS, MAX_USER_REMINDERS, detect_format, format_import_report,
+                  import_reminders, open_text, write_export)
+from delivery import DeliveryQueue
+from logging_setup import setup_logging
+from models import Reminder
+from recurrence import (CATCHUP_POLICY, DEFAULT_TIMEZONE, GRACE_PERIOD, SNOOZE_OPTIONS, Repeat, advance, get_zone,
+                        is_valid_timezone, next_occurrence, schedule_time, snooze_time, to_wall)
+from rendering import format_time, render_archive_entry, render_card, render_confirmation, render_notification
+from retention import ARCHIVE_BATCH_SIZE, RETENTION_INTERVAL, expiry_reason, is_paused
+from reminder_scheduler import ReminderScheduler
+from sharding import SHARD_COUNT, LeaseStore, ShardCoordinator
+from storage import SqliteStorage, create_storage
+
 # Загрузка переменных окружения
 load_dotenv()
 
-# Настройка логирования
-logging.basicConfig(level=logging.INFO)
+# Настройка логирования (уровни компонентов и формат задаются через LOG_*)
+setup_logging()
 logger = logging.getLogger(__name__)
+# Планировщик пишет одну сводку за такт, а не строку на каждое напоминание
+scheduler_logger = logging.getLogger('scheduler')
+
+# Режим работы: long polling (по умолчанию) или вебхук
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+# Роль процесса: all - обработчики и планировщик, bot - только обработчики,
+# worker - только планировщик (для шардированного режима, SHARD_COUNT > 0)
+BOT_ROLE = os.getenv('BOT_ROLE', 'all')
+SHARD_POLL_INTERVAL = float(os.getenv('SHARD_POLL_INTERVAL', 1))
+SHARD_BATCH_SIZE = 500
+# Сколько пересчитанных при загрузке времён срабатывания записывается одной транзакцией
+SCHEDULE_SAVE_BATCH = 1000
+WEBHOOK_BASE_URL = os.getenv('WEBHOOK_BASE_URL', '')
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', 8080))
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET') or None
+# Сколько секунд при остановке ждать отправки уже поставленных в очередь сообщений
+SHUTDOWN_TIMEOUT = float(os.getenv('SHUTDOWN_TIMEOUT', 10))
+# Куда записать отчёт о напоминаниях, пропущенных во время простоя (пусто - только в лог)
+DOWNTIME_REPORT_FILE = os.getenv('DOWNTIME_REPORT_FILE', 'downtime_report.json')
 
 # Инициализация бота
 bot = Bot(token=os.getenv('BOT_TOKEN'), default=DefaultBotProperties(parse_mode=ParseMode.HTML))
 dp = Dispatcher()
 
-# База данных (в реальном проекте используйте PostgreSQL или другую БД)
+def snooze_key(reminder_id):
+    """Ключ отложенного уведомления в планировщике (ключ самого напоминания - его id)"""
+    return ('snooze', reminder_id)
+
+# База данных: запись идёт через подключаемое хранилище. Напоминания JSON-хранилища
+# держатся в памяти, а SQLite-хранилище само отвечает на выборки по своим индексам
 class Database:
-    def __init__(self):
-        self.reminders_file = 'reminders.json'
-        self.users_file = 'users.json'
+    def __init__(self, scheduler=None, storage=None, shared=False):
+        self.scheduler = scheduler
+        self.storage = storage if storage is not None else create_storage()
+        # shared=True: хранилище меняют и другие процессы (шардированные воркеры)
+        self.shared = shared
+        # resident=False: в памяти только очередь планировщика (id и время срабатывания),
+        # напоминания читаются из хранилища при обращении
+        self.resident = self.storage.resident and not shared
         self.load_data()
     
     def load_data(self):
-        try:
-            with open(self.reminders_file, 'r', encoding='utf-8') as f:
-                self.reminders = json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError):
-            self.reminders = []
+        reminders, self.users = self.storage.load()
+        # Индексы: id -> напоминание и user_id -> {id: напоминание} (в порядке создания)
+        self._by_id = {}
+        self._by_user = {}
+        self._next_id = self.storage.load_sequence()
         
-        try:
-            with open(self.users_file, 'r', encoding='utf-8') as f:
-                self.users = json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError):
-            self.users = {}
+        if self.scheduler is not None:
+            self.scheduler.clear()
+        now = time.time()
+        # Напоминания, время которых прошло, пока бот был выключен: (напоминание, пропущенное время)
+        self.missed = []
+        # Без индекса в памяти дубли id находит само хранилище, до чтения остальных записей
+        duplicates = [] if self.resident else self.storage.get_duplicate_reminders()
+        renumbered = {(reminder.user_id, reminder.id) for reminder in duplicates}
+        # Пересчитанные времена, которые надо записать в хранилище: по столбцу next_fire_at
+        # выбирают наступившие напоминания воркеры шардированного режима
+        rescheduled = []
+        for reminder in reminders:
+            if self.resident and (not isinstance(reminder.id, int) or reminder.id in self._by_id):
+                duplicates.append(reminder)
+                continue
+            if renumbered and (reminder.user_id, reminder.id) in renumbered:
+                continue
+            self._next_id = max(self._next_id, reminder.id + 1)
+            self._index(reminder)
+            self._check_missed(reminder, now)
+            stored_fire_at = reminder.next_fire_at
+            self.reschedule(reminder, now)
+            if not self.resident and reminder.next_fire_at != stored_fire_at:
+                rescheduled.append((reminder, stored_fire_at))
+                if len(rescheduled) >= SCHEDULE_SAVE_BATCH:
+                    self.storage.save_schedules(rescheduled)
+                    rescheduled = []
+        if rescheduled:
+            self.storage.save_schedules(rescheduled)
+        
+        # Старые версии выдавали id повторно после удаления - перенумеровываем дубли
+        for reminder in duplicates:
+            old = reminder.copy()
+            reminder.id = self._allocate_id()
+            self._index(reminder)
+            self.reschedule(reminder, now)
+            self.storage.delete_reminder(old)
+            self.storage.save_reminder(reminder)
+            logger.warning("Reminder id %s of user %s was duplicated, renumbered to %s",
+                           old.id, reminder.user_id, reminder.id)
+        if duplicates:
+            # Старый id остаётся у другой записи, поэтому в журнал перенумерацию не записать
+            self.storage.compact()
+    
+    def _check_missed(self, reminder, now):
+        fire_at = reminder.next_fire_at
+        if reminder.active and fire_at is not None and fire_at < now - GRACE_PERIOD:
+            self.missed.append((reminder, fire_at))
+    
+    @property
+    def reminders(self):
+        """Все напоминания (итерация по индексу)"""
+        if not self.resident:
+            return list(self.storage.iter_reminders())
+        return self._by_id.values()
+    
+    def reminder_count(self, user_id=None):
+        """Число напоминаний пользователя (или всех), включая приостановленные"""
+        if not self.resident:
+            return self.storage.count_reminders(user_id)
+        return len(self._by_id if user_id is None else self._by_user.get(user_id, {}))
+    
+    def _allocate_id(self):
+        reminder_id = max(self._next_id, 1)
+        self._next_id = reminder_id + 1
+        self.storage.save_sequence(self._next_id)
+        return reminder_id
     
-    def save_reminders(self):
-        with open(self.reminders_file, 'w', encoding='utf-8') as f:
-            json.dump(self.reminders, f, ensure_ascii=False, indent=2)
+    def _index(self, reminder):
+        if not self.resident:
+            return
+        self._by_id[reminder.id] = reminder
+        self._by_user.setdefault(reminder.user_id, {})[reminder.id] = reminder
     
-    def save_users(self):
-        with open(self.users_file, 'w', encoding='utf-8') as f:
-            json.dump(self.users, f, ensure_ascii=False, indent=2)
+    def get_reminder(self, reminder_id, user_id):
+        """Напоминание пользователя по id или None"""
+        if not self.resident:
+            return self.storage.get_reminder(reminder_id, user_id)
+        reminder = self._by_id.get(reminder_id)
+        if reminder is None or reminder.user_id != user_id:
+            return None
+        return reminder
+    
+    def scheduled_reminder(self, key, entry):
+        """Напоминание для записи планировщика (см. _scheduler_entry) или None, если его уже нет"""
+        if self.resident:
+            return entry
+        reminder_id = key[1] if isinstance(key, tuple) else key
+        return self.storage.get_reminder(reminder_id, entry)
+    
+    def _scheduler_entry(self, reminder):
+        # Без копии в памяти планировщик хранит только user_id - ключ для чтения из хранилища
+        return reminder if self.resident else reminder.user_id
+    
+    def reschedule(self, reminder, now=None, catch_up=True):
+        """Пересчитывает время срабатывания напоминания и ставит его в планировщик.
+
+        catch_up=False - только будущие срабатывания: пропущенное за время паузы
+        или до смены пояса не отправляется.
+        """
+        now = now if now is not None else time.time()
+        if not reminder.active:
+            fire_at = None
+        elif catch_up:
+            fire_at = schedule_time(reminder, now)
+        else:
+            fire_at = next_occurrence(reminder, now)
+        self._set_next_fire(reminder, fire_at)
+    
+    def _set_next_fire(self, reminder, fire_at):
+        reminder.next_fire_at = fire_at
+        if self.scheduler is None:
+            return
+        if fire_at is None:
+            self.scheduler.unschedule(reminder.id)
+        else:
+            self.scheduler.schedule(reminder.id, fire_at, self._scheduler_entry(reminder))
     
     def add_user(self, user_id, username, first_name):
-        if str(user_id) not in self.users:
-            self.users[str(user_id)] = {
+        # Запись без registered_at бывает, если пользователь сначала выбрал пояс (/timezone),
+        # а /start прислал позже: дополняем её, сохраняя пояс
+        user = self.users.get(str(user_id), {})
+        if 'registered_at' not in user:
+            user.update({
                 'username': username,
                 'first_name': first_name,
                 'registered_at': datetime.datetime.now().isoformat()
-            }
-            self.save_users()
+            })
+            self.users[str(user_id)] = user
+            self.storage.save_user(str(user_id), user)
+    
+    def get_user_timezone(self, user_id):
+        """Часовой пояс пользователя (IANA) или пояс по умолчанию"""
+        return self.users.get(str(user_id), {}).get('timezone') or DEFAULT_TIMEZONE
+    
+    def set_user_timezone(self, user_id, timezone):
+        """Меняет пояс пользователя и переводит в него все его напоминания"""
+        get_zone(timezone)
+        user = self.users.setdefault(str(user_id), {})
+        user['timezone'] = timezone
+        self.storage.save_user(str(user_id), user)
+        # Напоминания срабатывают в то же локальное время, но уже в новом поясе
+        # Приостановленные тоже: после возобновления они должны идти по новому поясу
+        for reminder in list(self.iter_reminders(user_id)):
+            reminder.timezone = timezone
+            self.reschedule(reminder, catch_up=False)
+            self.storage.save_reminder(reminder)
     
     def add_reminder(self, reminder_data):
-        reminder_data['id'] = len(self.reminders) + 1
-        reminder_data['created_at'] = datetime.datetime.now().isoformat()
-        reminder_data['active'] = True
-        self.reminders.append(reminder_data)
-        self.save_reminders()
-        return reminder_data
+        """Создаёт напоминание из данных в JSON-формате (Web App) и возвращает Reminder"""
+        # Напоминание и счётчик id сохраняются одной записью, как при импорте
+        reminder, = self.add_reminders([dict(reminder_data, active=True)])
+        return reminder
+    
+    def add_reminders(self, reminders_data):
+        """Добавляет пачку напоминаний одной записью в хранилище (массовый импорт)"""
+        now = time.time()
+        first_id = max(self._next_id, 1)
+        reminders = []
+        for reminder_id, reminder_data in enumerate(reminders_data, first_id):
+            reminder = self._new_reminder(reminder_data, reminder_id, int(now))
+            self._index(reminder)
+            self.reschedule(reminder, now)
+            reminders.append(reminder)
+        self._next_id = first_id + len(reminders)
+        self.storage.save_reminders(reminders, self._next_id)
+        metrics.REMINDERS_CREATED.inc(len(reminders))
+        return reminders
+    
+    def _new_reminder(self, reminder_data, reminder_id, created_at):
+        reminder = Reminder.from_dict(reminder_data)
+        reminder.id = reminder_id
+        reminder.created_at = created_at
+        if reminder.timezone is None:
+            reminder.timezone = self.get_user_timezone(reminder.user_id)
+        return reminder
+    
+    def mark_fired(self, reminder, fired_at, now=None):
+        """Фиксирует отправку напоминания и ставит следующее срабатывание"""
+        now = now if now is not None else time.time()
+        expected_fire_at = reminder.next_fire_at
+        reminder.last_fired_at = fired_at
+        # Для одноразовых напоминаний отключаем после отправки
+        if reminder.repeat is Repeat.NONE:
+            reminder.active = False
+        fire_at = advance(reminder, fired_at, now) if reminder.active else None
+        self._set_next_fire(reminder, fire_at)
+        if not self.shared:
+            self.storage.save_reminder(reminder)
+            return
+        # Пока воркер отправлял, другой процесс мог удалить или приостановить напоминание:
+        # устаревшая копия не должна перезаписать его строку
+        self.storage.save_fired(reminder, expected_fire_at)
     
     def get_user_reminders(self, user_id):
-        return [r for r in self.reminders if r.get('user_id') == user_id and r.get('active', True)]
+        if not self.resident:
+            return self.storage.get_user_reminders(user_id)
+        return [r for r in self._by_user.get(user_id, {}).values() if r.active]
+    
+    def iter_reminders(self, user_id=None):
+        """Все напоминания пользователя (или всех пользователей), включая приостановленные"""
+        if not self.resident:
+            return self.storage.iter_reminders(user_id)
+        source = self._by_id if user_id is None else self._by_user.get(user_id, {})
+        # Копируем только ссылки: во время экспорта напоминания могут добавляться
+        return iter(list(source.values()))
+    
+    def get_user_reminders_page(self, user_id, offset, limit):
+        """Срез активных и приостановленных напоминаний пользователя и их общее число.
+
+        Отправленные разовые не показываются: их уже нечего включать.
+        """
+        if not self.resident:
+            return self.storage.get_user_reminders_page(user_id, offset, limit)
+        user_reminders = self._by_user.get(user_id, {}).values()
+        total = sum(1 for r in user_reminders if r.active or is_paused(r))
+        listed = (r for r in user_reminders if r.active or is_paused(r))
+        return list(itertools.islice(listed, offset, offset + limit)), total
     
     def delete_reminder(self, reminder_id, user_id):
-        self.reminders = [r for r in self.reminders if not (r['id'] == reminder_id and r.get('user_id') == user_id)]
-        self.save_reminders()
+        reminder = self.get_reminder(reminder_id, user_id)
+        if reminder is None:
+            return
+        self._unindex(reminder)
+        self._set_next_fire(reminder, None)
+        self.cancel_snooze(reminder_id)
+        self.storage.delete_reminder(reminder)
+        metrics.REMINDERS_DELETED.inc()
     
     def toggle_reminder(self, reminder_id, user_id):
-        for reminder in self.reminders:
-            if reminder['id'] == reminder_id and reminder.get('user_id') == user_id:
-                reminder['active'] = not reminder.get('active', True)
-                self.save_reminders()
-                return reminder['active']
-        return None
+        reminder = self.get_reminder(reminder_id, user_id)
+        if reminder is None:
+            return None
+        reminder.active = not reminder.active
+        # Время паузы нужно для архивации давно приостановленных напоминаний
+        reminder.paused_at = None if reminder.active else int(time.time())
+        self.reschedule(reminder, catch_up=False)
+        if not reminder.active:
+            self.cancel_snooze(reminder_id)
+        self.storage.save_reminder(reminder)
+        metrics.REMINDERS_TOGGLED.inc()
+        return reminder.active
+    
+    def snooze(self, reminder, option, now=None):
+        """Откладывает уведомление: ставит в планировщик временный таймер.
+
+        В хранилище ничего не пишется и само напоминание не меняется; после
+        перезапуска отложенные уведомления не восстанавливаются.
+        """
+        now = now if now is not None else time.time()
+        fire_at = snooze_time(option, now, reminder.timezone or self.get_user_timezone(reminder.user_id))
+        self.scheduler.schedule(snooze_key(reminder.id), fire_at, self._scheduler_entry(reminder))
+        metrics.REMINDERS_SNOOZED.inc()
+        return fire_at
+    
+    def cancel_snooze(self, reminder_id):
+        if self.scheduler is not None:
+            self.scheduler.unschedule(snooze_key(reminder_id))
+    
+    def archive_expired(self, now=None, fired_ttl=None, paused_ttl=None, limit=None):
+        """Переносит в архив отправленные разовые и давно приостановленные напоминания.
+
+        limit ограничивает число переносимых за вызов. Возвращает статистику: сколько
+        перенесено (всего и по причинам) и сколько байт данных ушло из рабочего набора.
+        """
+        now = now if now is not None else time.time()
+        expired = []
+        # Истекают только неактивные: хранилище с индексами не читает остальные записи
+        candidates = self.iter_reminders() if self.resident else self.storage.iter_reminders(active=False)
+        for reminder in candidates:
+            reason = expiry_reason(reminder, now, fired_ttl, paused_ttl)
+            if reason is not None:
+                expired.append((reminder, reason))
+                if len(expired) == limit:
+                    break
+        
+        stats = {'archived': len(expired), 'fired': 0, 'paused': 0, 'reclaimed_bytes': 0}
+        for start in range(0, len(expired), ARCHIVE_BATCH_SIZE):
+            batch = expired[start:start + ARCHIVE_BATCH_SIZE]
+            stats['reclaimed_bytes'] += self.storage.archive_reminders(batch, int(now))
+            for reminder, reason in batch:
+                stats[reason] += 1
+                self._unindex(reminder)
+                self.cancel_snooze(reminder.id)
+        if expired:
+            metrics.REMINDERS_ARCHIVED.inc(stats['archived'])
+            metrics.ARCHIVED_BYTES.inc(stats['reclaimed_bytes'])
+            logger.info("Archived %(archived)s reminders (%(fired)s fired, %(paused)s paused), "
+                        "reclaimed %(reclaimed_bytes)s bytes", stats, extra=stats)
+        return stats
+    
+    def _unindex(self, reminder):
+        if not self.resident:
+            return
+        self._by_id.pop(reminder.id, None)
+        reminders = self._by_user.get(reminder.user_id)
+        if reminders is not None:
+            reminders.pop(reminder.id, None)
+            if not reminders:
+                del self._by_user[reminder.user_id]
+
+reminder_scheduler = ReminderScheduler()
+delivery_queue = DeliveryQueue(bot.send_message)
+storage = create_storage()
+# Общим хранилищем шардированного режима может быть только SQLite: JSON-файлы
+# каждый процесс держит в своей памяти, и обработчики не увидели бы чужих изменений
+if SHARD_COUNT and not isinstance(storage, SqliteStorage):
+    raise RuntimeError("SHARD_COUNT > 0 requires STORAGE_BACKEND=sqlite")
+# В шардированном режиме напоминания берутся из общего хранилища, очередь в памяти не нужна
+db = Database(scheduler=None if SHARD_COUNT else reminder_scheduler, storage=storage, shared=bool(SHARD_COUNT))
 
-db = Database()
+# Значения датчиков считаются в момент чтения /metrics
+metrics.ACTIVE_REMINDERS.set_function(lambda: len(reminder_scheduler))
+metrics.DELIVERY_QUEUE_DEPTH.set_function(lambda: len(delivery_queue))
+metrics.STORE_SIZE.set_function(db.reminder_count)
 
 # Клавиатура с Web App кнопкой
 def get_main_keyboard():
@@ -137,6 +458,10 @@ async def cmd_help(message: types.Message):
 /start - Начать работу с ботом
 /help - Показать эту справку
 /my_reminders - Показать мои напоминания
+/timezone - Часовой пояс (например, /timezone Europe/Berlin)
+/import - Загрузить напоминания из файла JSONL или CSV
+/export - Выгрузить напоминания в файл (/export csv)
+/history - Архив выполненных напоминаний
 /delete_webhook - Удалить вебхук (если бот не работает)
 
 <b>Как использовать:</b>
@@ -144,6 +469,7 @@ async def cmd_help(message: types.Message):
 2. Создайте напоминание через красивый интерфейс
 3. Выберите дату, время и тип повторения
 4. Бот пришлёт уведомление в нужное время!
+5. Под уведомлением можно отложить его (10 минут, час, до завтра) или отметить выполненным
 
 <b>Типы повторения:</b>
 • Один раз - стандартное напоминание
@@ -155,65 +481,98 @@ async def cmd_help(message: types.Message):
     """
     await message.answer(help_text, parse_mode=ParseMode.HTML)
 
+# Часовой пояс пользователя
+@dp.message(Command("timezone"))
+async def cmd_timezone(message: types.Message):
+    user_id = message.from_user.id
+    parts = (message.text or "").split(maxsplit=1)
+    
+    if len(parts) < 2:
+        await message.answer(
+            f"🌍 Ваш часовой пояс: <b>{db.get_user_timezone(user_id)}</b>\n\n"
+            f"Чтобы изменить его, отправьте, например: /timezone Europe/Berlin",
+            parse_mode=ParseMode.HTML)
+        return
+    
+    timezone = parts[1].strip()
+    if not is_valid_timezone(timezone):
+        await message.answer("❌ Неизвестный часовой пояс. Используйте название IANA, например Europe/Moscow или Asia/Yekaterinburg.")
+        return
+    
+    db.set_user_timezone(user_id, timezone)
+    await message.answer(f"✅ Часовой пояс изменён на <b>{timezone}</b>. Напоминания будут приходить по местному времени.",
+                         parse_mode=ParseMode.HTML)
+
+# Список напоминаний показывается одним сообщением по REMINDERS_PAGE_SIZE штук
+REMINDERS_PAGE_SIZE = 5
+NO_REMINDERS_TEXT = "📭 У вас пока нет активных напоминаний!\n\nНажмите кнопку '📱 Открыть приложение' чтобы создать первое напоминание."
+
+def render_reminders_page(user_id, page):
+    """Текст и клавиатура страницы списка напоминаний; (None, None), если список пуст"""
+    reminders, total = db.get_user_reminders_page(user_id, page * REMINDERS_PAGE_SIZE, REMINDERS_PAGE_SIZE)
+    if total == 0:
+        return None, None
+    pages = (total + REMINDERS_PAGE_SIZE - 1) // REMINDERS_PAGE_SIZE
+    if not reminders:
+        # Страница опустела после удаления - показываем последнюю
+        return render_reminders_page(user_id, pages - 1)
+    
+    lines = [f"📋 <b>Ваши напоминания</b> ({total}), стр. {page + 1}/{pages}"]
+    builder = InlineKeyboardBuilder()
+    for number, reminder in enumerate(reminders, page * REMINDERS_PAGE_SIZE + 1):
+        lines.append(render_card(number, reminder))
+        toggle_text = f"⏸️ {number}" if reminder.active else f"▶️ {number}"
+        builder.button(text=toggle_text, callback_data=f"toggle_{reminder.id}_{page}")
+        builder.button(text=f"🗑️ {number}", callback_data=f"delete_{reminder.id}_{page}")
+    
+    navigation = []
+    if page > 0:
+        navigation.append(("⬅️ Назад", f"page_{page - 1}"))
+    if page < pages - 1:
+        navigation.append(("Вперёд ➡️", f"page_{page + 1}"))
+    for text, callback_data in navigation:
+        builder.button(text=text, callback_data=callback_data)
+    builder.adjust(*([2] * len(reminders)), *([len(navigation)] if navigation else []))
+    return "\n".join(lines), builder.as_markup()
+
+async def update_reminders_page(callback, page):
+    """Перерисовывает список напоминаний в том же сообщении"""
+    text, markup = render_reminders_page(callback.from_user.id, page)
+    try:
+        await callback.message.edit_text(text or NO_REMINDERS_TEXT, parse_mode=ParseMode.HTML, reply_markup=markup)
+    except TelegramBadRequest as e:
+        # Содержимое не изменилось (например, двойное нажатие)
+        logger.debug("Reminders page not updated: %s", e)
+
+def parse_callback(data):
+    """Разбирает callback_data вида action_id[_page]; у старых кнопок страницы нет"""
+    parts = data.split("_")
+    reminder_id = int(parts[1])
+    page = int(parts[2]) if len(parts) > 2 else 0
+    return reminder_id, page
+
 # Показать напоминания пользователя
 @dp.message(Command("my_reminders"))
 @dp.message(F.text == "📋 Мои напоминания")
 async def show_reminders(message: types.Message):
-    user_id = message.from_user.id
-    reminders = db.get_user_reminders(user_id)
+    text, markup = render_reminders_page(message.from_user.id, 0)
     
-    if not reminders:
-        await message.answer("📭 У вас пока нет активных напоминаний!\n\nНажмите кнопку '📱 Открыть приложение' чтобы создать первое напоминание.")
+    if text is None:
+        await message.answer(NO_REMINDERS_TEXT)
         return
     
-    # Сначала отправляем заголовок
-    await message.answer("📋 <b>Ваши напоминания:</b>", parse_mode=ParseMode.HTML)
-    
-    for reminder in reminders[:10]:  # Ограничиваем показ 10 напоминаниями
-        dt = datetime.datetime.fromisoformat(reminder['datetime'])
-        formatted_date = dt.strftime("%d.%m.%Y")
-        formatted_time = dt.strftime("%H:%M")
-        
-        repeat_text = ""
-        if reminder['repeat'] == 'daily':
-            repeat_text = "🔄 Ежедневно"
-        elif reminder['repeat'] == 'weekly':
-            repeat_text = "📅 Еженедельно"
-        elif reminder['repeat'] == 'custom' and reminder.get('days'):
-            day_names = ['Вс', 'Пн', 'Вт', 'Ср', 'Чт', 'Пт', 'Сб']
-            days = [day_names[d] for d in reminder['days']]
-            repeat_text = f"📌 По дням: {', '.join(days)}"
-        else:
-            repeat_text = "⏰ Один раз"
-        
-        status = "✅ Активно" if reminder.get('active', True) else "⏸️ Приостановлено"
-        
-        reminder_text = f"""
-📝 <b>{reminder['text']}</b>
-📅 {formatted_date} ⏰ {formatted_time}
-{repeat_text}
-{status}
-🔹 ID: {reminder['id']}
-        """
-        
-        # Добавляем кнопки управления
-        builder = InlineKeyboardBuilder()
-        if reminder.get('active', True):
-            builder.button(text="⏸️ Приостановить", callback_data=f"toggle_{reminder['id']}")
-        else:
-            builder.button(text="▶️ Возобновить", callback_data=f"toggle_{reminder['id']}")
-        builder.button(text="🗑️ Удалить", callback_data=f"delete_{reminder['id']}")
-        builder.adjust(2)
-        
-        await message.answer(reminder_text, parse_mode=ParseMode.HTML, reply_markup=builder.as_markup())
-    
-    if len(reminders) > 10:
-        await message.answer(f"📖 И ещё {len(reminders) - 10} напоминаний...\nИспользуйте приложение для полного просмотра.")
+    await message.answer(text, parse_mode=ParseMode.HTML, reply_markup=markup)
 
 # Обработка callback от кнопок
+@dp.callback_query(F.data.startswith("page_"))
+async def show_reminders_page(callback: types.CallbackQuery):
+    page = int(callback.data.split("_")[1])
+    await callback.answer()
+    await update_reminders_page(callback, page)
+
 @dp.callback_query(F.data.startswith("toggle_"))
 async def toggle_reminder(callback: types.CallbackQuery):
-    reminder_id = int(callback.data.split("_")[1])
+    reminder_id, page = parse_callback(callback.data)
     user_id = callback.from_user.id
     
     new_state = db.toggle_reminder(reminder_id, user_id)
@@ -221,21 +580,144 @@ async def toggle_reminder(callback: types.CallbackQuery):
     if new_state is not None:
         status = "активно" if new_state else "приостановлено"
         await callback.answer(f"Напоминание {status}!")
-        await callback.message.edit_reply_markup(reply_markup=None)
-        await callback.message.answer(f"✅ Статус напоминания изменен: {'✅ Активно' if new_state else '⏸️ Приостановлено'}")
+        await update_reminders_page(callback, page)
     else:
         await callback.answer("Напоминание не найдено!")
 
 @dp.callback_query(F.data.startswith("delete_"))
 async def delete_reminder(callback: types.CallbackQuery):
-    reminder_id = int(callback.data.split("_")[1])
+    reminder_id, page = parse_callback(callback.data)
     user_id = callback.from_user.id
     
     db.delete_reminder(reminder_id, user_id)
     
     await callback.answer("Напоминание удалено!")
-    await callback.message.edit_reply_markup(reply_markup=None)
-    await callback.message.answer("🗑️ Напоминание успешно удалено!")
+    await update_reminders_page(callback, page)
+
+# Кнопки под уведомлением
+async def remove_notification_buttons(callback):
+    try:
+        await callback.message.edit_reply_markup(reply_markup=None)
+    except (TelegramBadRequest, AttributeError) as e:
+        # Кнопки уже убраны или сообщение слишком старое для редактирования
+        logger.debug("Notification buttons not removed: %s", e)
+
+@dp.callback_query(F.data.startswith("snooze_"))
+async def snooze_notification(callback: types.CallbackQuery):
+    _, reminder_id, option = callback.data.split("_")
+    reminder = db.get_reminder(int(reminder_id), callback.from_user.id)
+    if reminder is None or db.scheduler is None or option not in SNOOZE_OPTIONS:
+        await callback.answer("Напоминание не найдено!")
+        return
+    
+    fire_at = db.snooze(reminder, option)
+    zone = get_zone(reminder.timezone or db.get_user_timezone(reminder.user_id))
+    wall = to_wall(datetime.datetime.fromtimestamp(fire_at, zone).replace(tzinfo=None))
+    when = f"завтра в {format_time(wall)}" if option == 'tomorrow' else f"в {format_time(wall)}"
+    await callback.answer(f"⏰ Напомню {when}")
+    await remove_notification_buttons(callback)
+
+@dp.callback_query(F.data.startswith("done_"))
+async def acknowledge_notification(callback: types.CallbackQuery):
+    reminder_id = int(callback.data.split("_")[1])
+    if db.get_reminder(reminder_id, callback.from_user.id) is not None:
+        db.cancel_snooze(reminder_id)
+    await callback.answer("✅ Отлично, отмечено как выполненное!")
+    await remove_notification_buttons(callback)
+
+# Архив: отправленные разовые и давно приостановленные напоминания
+HISTORY_SIZE = 20
+
+@dp.message(Command("history"))
+async def cmd_history(message: types.Message):
+    records = await db.storage.recent_archive(message.from_user.id, HISTORY_SIZE)
+    if not records:
+        await message.answer("📭 В архиве пока ничего нет.")
+        return
+    lines = [f"🗄 <b>Архив напоминаний</b> (последние {len(records)})"]
+    lines.extend(render_archive_entry(record) for record in records)
+    await message.answer("\n".join(lines), parse_mode=ParseMode.HTML)
+
+# Массовый импорт и экспорт напоминаний
+MAX_IMPORT_FILE_SIZE = 20 * 1024 * 1024  # Bot API отдаёт ботам файлы до 20 МБ
+IMPORT_HELP_TEXT = """
+📥 <b>Импорт напоминаний</b>
+
+Отправьте файл <b>.jsonl</b> (одно напоминание в строке) или <b>.csv</b> с полями:
+<code>text</code>, <code>datetime</code> (например 2024-05-01T09:00), <code>repeat</code> (none, daily, weekly, custom),
+<code>days</code> (для custom: 0 - воскресенье, ..., 6 - суббота), <code>timezone</code> (необязательно).
+
+Файл, полученный через /export, можно загрузить обратно.
+"""
+
+REMINDERS_LIMIT_TEXT = f"❌ У вас уже {MAX_USER_REMINDERS} напоминаний - это максимум. Удалите ненужные в /my_reminders."
+
+def user_reminders_left(user_id):
+    """Сколько ещё напоминаний может создать пользователь (None - без ограничения, для ADMIN_IDS)"""
+    if user_id in ADMIN_IDS:
+        return None
+    return max(MAX_USER_REMINDERS - db.reminder_count(user_id), 0)
+
+@dp.message(Command("import"))
+async def cmd_import(message: types.Message):
+    await message.answer(IMPORT_HELP_TEXT, parse_mode=ParseMode.HTML)
+
+@dp.message(F.document)
+async def handle_import_file(message: types.Message):
+    document = message.document
+    if not (document.file_name or '').lower().endswith(('.jsonl', '.csv')):
+        await message.answer("❌ Поддерживаются файлы .jsonl и .csv. Подробнее: /import")
+        return
+    if document.file_size and document.file_size > MAX_IMPORT_FILE_SIZE:
+        await message.answer("❌ Файл слишком большой (максимум 20 МБ).")
+        return
+    
+    user_id = message.from_user.id
+    limit = user_reminders_left(user_id)
+    if limit == 0:
+        await message.answer(REMINDERS_LIMIT_TEXT)
+        return
+    if limit is not None:
+        limit = min(limit, MAX_IMPORT_RECORDS)
+    
+    try:
+        # Файл скачивается во временный файл и читается построчно
+        with tempfile.TemporaryFile() as f:
+            await bot.download(document, destination=f)
+            f.seek(0)
+            result = import_reminders(db, open_text(f), detect_format(document.file_name), user_id, limit=limit)
+    except Exception as e:
+        logger.error("Error importing file from user %s: %s", user_id, e)
+        await message.answer("❌ Не удалось загрузить файл. Попробуйте ещё раз.")
+        return
+    logger.info("User %s imported %s reminders (%s rejected)", user_id, result.imported, len(result.errors))
+    await message.answer(format_import_report(result), parse_mode=ParseMode.HTML)
+
+@dp.message(Command("export"))
+async def cmd_export(message: types.Message):
+    args = (message.text or "").split()[1:]
+    fmt = 'csv' if 'csv' in args else 'jsonl'
+    # /export all - все напоминания всех пользователей, только для ADMIN_IDS
+    user_id = message.from_user.id
+    if 'all' in args:
+        if user_id not in ADMIN_IDS:
+            await message.answer("❌ Полный экспорт доступен только администраторам.")
+            return
+        user_id = None
+    
+    # Напоминания пишутся во временный файл построчно, а не собираются в памяти
+    fd, path = tempfile.mkstemp(suffix=f'.{fmt}')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8', newline='') as f:
+            count = write_export(db.iter_reminders(user_id), f, fmt)
+        if count == 0:
+            await message.answer("📭 Нет напоминаний для экспорта.")
+            return
+        filename = f"reminders{'_all' if user_id is None else ''}.{fmt}"
+        await message.answer_document(FSInputFile(path, filename=filename),
+                                      caption=f"📤 Напоминаний в файле: {count}")
+    finally:
+        os.unlink(path)
 
 # Обработка данных из Web App
 @dp.message(F.web_app_data)
@@ -243,142 +725,320 @@ async def handle_web_app_data(message: types.Message):
     try:
         data = json.loads(message.web_app_data.data)
         user_id = message.from_user.id
+        if user_reminders_left(user_id) == 0:
+            await message.answer(REMINDERS_LIMIT_TEXT)
+            return
         
         # Добавляем user_id к данным напоминания
         data['user_id'] = user_id
         
-        # Преобразуем datetime в правильный формат
+        # Web App сообщает пояс браузера - запоминаем его, если пользователь не выбрал свой
+        timezone = data.pop('timezone', None)
+        if is_valid_timezone(timezone) and not db.users.get(str(user_id), {}).get('timezone'):
+            db.set_user_timezone(user_id, timezone)
+        data['timezone'] = db.get_user_timezone(user_id)
+        
+        # Храним местное время без смещения: срабатывание считается в поясе напоминания
         reminder_datetime = datetime.datetime.fromisoformat(data['datetime'].replace('Z', '+00:00'))
+        if reminder_datetime.tzinfo is not None:
+            reminder_datetime = reminder_datetime.astimezone(get_zone(data['timezone'])).replace(tzinfo=None)
         data['datetime'] = reminder_datetime.isoformat()
         
         # Добавляем напоминание в базу
         reminder = db.add_reminder(data)
         
-        # Формируем текст подтверждения
-        dt = reminder_datetime
-        formatted_date = dt.strftime("%d.%m.%Y")
-        formatted_time = dt.strftime("%H:%M")
-        
-        repeat_text = ""
-        if data['repeat'] == 'daily':
-            repeat_text = "🔄 Ежедневно"
-        elif data['repeat'] == 'weekly':
-            repeat_text = "📅 Еженедельно"
-        elif data['repeat'] == 'custom' and data.get('days'):
-            day_names = ['Вс', 'Пн', 'Вт', 'Ср', 'Чт', 'Пт', 'Сб']
-            days = [day_names[d] for d in data['days']]
-            repeat_text = f"📌 По дням: {', '.join(days)}"
-        else:
-            repeat_text = "⏰ Один раз"
-        
-        confirmation_text = f"""
-✅ <b>Напоминание создано!</b>
-
-📝 <b>Текст:</b> {data['text']}
-📅 <b>Дата:</b> {formatted_date}
-⏰ <b>Время:</b> {formatted_time}
-🔄 <b>Повторение:</b> {repeat_text}
-
-💡 Бот пришлёт уведомление в назначенное время!
-        """
-        
-        await message.answer(confirmation_text, parse_mode=ParseMode.HTML)
+        await message.answer(render_confirmation(reminder), parse_mode=ParseMode.HTML)
         
     except Exception as e:
-        logger.error(f"Error processing web app data: {e}")
+        logger.error("Error processing web app data: %s", e)
         await message.answer("❌ Произошла ошибка при создании напоминания. Попробуйте ещё раз.")
 
 # Функции для планировщика напоминаний
 async def check_reminders():
-    """Проверяет и отправляет напоминания"""
-    now = datetime.datetime.now() 
-    logger.info("Checking reminders...")
+    """Отправляет напоминания, время которых наступило"""
+    started = time.perf_counter()
+    now = time.time()
+    due = reminder_scheduler.pop_due(now)
     
-    for reminder in db.reminders:
-        if not reminder.get('active', True):
+    queued = 0
+    for key, fire_at, entry in due:
+        reminder = db.scheduled_reminder(key, entry)
+        if reminder is None:
             continue
-            
-        reminder_time = datetime.datetime.fromisoformat(reminder['datetime'])
-        user_id = reminder.get('user_id')
-        
-        if should_send_reminder(now, reminder_time, reminder):
-            await send_reminder_notification(user_id, reminder)
-            
-            # Для одноразовых напоминаний отключаем после отправки
-            if reminder.get('repeat') == 'none':
-                reminder['active'] = False
-                db.save_reminders()
-
-def should_send_reminder(now, reminder_time, reminder):
-    """Определяет, нужно ли отправлять напоминание"""
-    logger.info(f"Checking reminder: {reminder['text']}")
-    logger.info(f"Now: {now}, Reminder time: {reminder_time}")
-    logger.info(f"Repeat type: {reminder.get('repeat')}")
-    
-    if reminder.get('repeat') == 'none':
-        # Для одноразовых - проверяем точное время
-        result = now.strftime("%Y-%m-%d %H:%M") == reminder_time.strftime("%Y-%m-%d %H:%M")
-        logger.info(f"One-time check result: {result}")
-        return result
-    
-    elif reminder.get('repeat') == 'daily':
-        # Ежедневно - проверяем время
-        result = now.time() == reminder_time.time()
-        logger.info(f"Daily check result: {result}")
-        return result
-    
-    elif reminder.get('repeat') == 'weekly':
-        # Еженедельно - проверяем день недели и время
-        result = now.weekday() == reminder_time.weekday() and now.time() == reminder_time.time()
-        logger.info(f"Weekly check result: {result}")
-        return result
-    
-    elif reminder.get('repeat') == 'custom' and reminder.get('days'):
-        # Выбранные дни - проверяем день недели и время
-        result = now.weekday() in reminder['days'] and now.time() == reminder_time.time()
-        logger.info(f"Custom days check result: {result}")
-        return result
-    
-    logger.info("No matching repeat type found")
-    return False
-
-async def send_reminder_notification(user_id, reminder):
-    """Отправляет уведомление о напоминании"""
-    try:
-        user = db.users.get(str(user_id), {})
-        username = user.get('first_name', 'Друг')
-        
-        message_text = f"""
-🔔 <b>Напоминалкин напоминает!</b>
+        queued += send_reminder_notification(reminder.user_id, reminder, fire_at)
+        # Отложенное уведомление - временный таймер: само напоминание не сдвигается
+        if key == reminder.id:
+            db.mark_fired(reminder, fire_at)
+    
+    record_tick(len(due), len(due), queued, started)
 
-Помнишь то что ты указал "{reminder['text']}"? 
-Так вот, напоминаю тебе, что это нужно сделать сегодня.
+def record_tick(evaluated, due, queued, started):
+    """Метрика и сводка такта планировщика: INFO, если что-то сработало, иначе DEBUG"""
+    duration = time.perf_counter() - started
+    metrics.TICK_DURATION.observe(duration)
+    level = logging.INFO if due else logging.DEBUG
+    if not scheduler_logger.isEnabledFor(level):
+        return
+    stats = {
+        'evaluated': evaluated,
+        'due': due,
+        'queued': queued,
+        'failed': due - queued,
+        'sent_total': delivery_queue.stats['sent'],
+        'failed_total': delivery_queue.stats['failed'],
+        'duration_ms': round(duration * 1000, 2),
+    }
+    scheduler_logger.log(level, "Tick: evaluated=%(evaluated)s due=%(due)s queued=%(queued)s failed=%(failed)s "
+                                "sent_total=%(sent_total)s failed_total=%(failed_total)s duration=%(duration_ms)sms",
+                         stats, extra=stats)
 
-Хорошего тебе дня, {username}! 🌟
-        """
-        
-        await bot.send_message(user_id, message_text, parse_mode=ParseMode.HTML)
-        logger.info(f"Sent reminder to user {user_id}: {reminder['text']}")
+# Кнопки под уведомлением: варианты SNOOZE_OPTIONS и «Готово»
+SNOOZE_BUTTONS = (('10m', "⏰ 10 мин"), ('1h', "⏰ 1 час"), ('tomorrow', "📅 Завтра"))
+
+def notification_keyboard(reminder_id):
+    # Без InlineKeyboardBuilder: клавиатура собирается на каждое уведомление, а он в разы медленнее
+    rows = []
+    if db.scheduler is not None:
+        # Отложенные уведомления живут в планировщике этого процесса, в шардированном режиме его нет
+        rows.append([InlineKeyboardButton(text=text, callback_data=f"snooze_{reminder_id}_{option}")
+                     for option, text in SNOOZE_BUTTONS])
+    rows.append([InlineKeyboardButton(text="✅ Готово", callback_data=f"done_{reminder_id}")])
+    return InlineKeyboardMarkup(inline_keyboard=rows)
+
+def send_reminder_notification(user_id, reminder, fire_at=None):
+    """Ставит уведомление о напоминании в очередь отправки; True, если поставлено"""
+    try:
+        message_text = render_notification(reminder, db.users.get(str(user_id), {}))
+        delivery_queue.submit(user_id, message_text, scheduled_at=fire_at, parse_mode=ParseMode.HTML,
+                              reply_markup=notification_keyboard(reminder.id))
+        return True
         
     except Exception as e:
-        logger.error(f"Error sending reminder to user {user_id}: {e}")
+        scheduler_logger.error("Error sending reminder to user %s: %s", user_id, e)
+        return False
 
 # Настройка планировщика
 async def scheduler():
     """Запускает планировщик напоминаний"""
     while True:
-        await check_reminders()
-        await asyncio.sleep(30)  # Проверяем каждые 30 секунд
+        # Ошибка одного прохода (например, хранилища) не должна останавливать планировщик
+        try:
+            await check_reminders()
+        except Exception as e:
+            logger.error("Error checking reminders: %s", e)
+        await reminder_scheduler.wait()  # Спим до ближайшего напоминания
+
+async def sharded_scheduler():
+    """Планировщик шардированного режима: обрабатывает только арендованные шарды"""
+    coordinator = ShardCoordinator(LeaseStore())
+    pruned_at = 0
+    try:
+        while True:
+            due = []
+            # Ошибка одного прохода (например, занятая база) не должна останавливать воркер
+            try:
+                started = time.perf_counter()
+                now = time.time()
+                shards = coordinator.refresh(now)
+                due = db.storage.get_due_reminders(now, SHARD_COUNT, shards, SHARD_BATCH_SIZE) if shards else []
+                claimed = queued = 0
+                for reminder in due:
+                    fire_at = reminder.next_fire_at
+                    # Ключ идемпотентности не даёт отправить срабатывание дважды,
+                    # даже если аренда шарда успела перейти к другому воркеру
+                    if coordinator.claim_delivery(reminder, fire_at):
+                        claimed += 1
+                        queued += send_reminder_notification(reminder.user_id, reminder, fire_at)
+                    db.mark_fired(reminder, fire_at, now)
+                record_tick(len(due), claimed, queued, started)
+                if now - pruned_at > 3600:
+                    coordinator.lease_store.prune_deliveries(now)
+                    pruned_at = now
+            except Exception as e:
+                logger.error("Error processing shard reminders: %s", e)
+                due = []
+            await asyncio.sleep(0 if len(due) == SHARD_BATCH_SIZE else SHARD_POLL_INTERVAL)
+    finally:
+        coordinator.release()
+        coordinator.lease_store.close()
+
+# Фоновые задачи запускаются и останавливаются вместе с диспетчером в обоих режимах
+background_tasks = []
+# Задачу записи хранилища не отменяют, а просят остановиться (см. stop_background_tasks)
+flusher_task = None
+
+def start_background_tasks():
+    global flusher_task
+    delivery_queue.start()
+    if BOT_ROLE != 'bot':
+        background_tasks.append(asyncio.create_task(sharded_scheduler() if SHARD_COUNT else scheduler()))
+    flusher_task = asyncio.create_task(db.storage.run_flusher())
+    # Архивацию ведёт один процесс: воркеры шардированного режима её не запускают
+    if BOT_ROLE != 'worker' and RETENTION_INTERVAL > 0:
+        background_tasks.append(asyncio.create_task(retention_task()))
+
+async def retention_task():
+    """Раз в RETENTION_INTERVAL секунд переносит истёкшие напоминания в архив"""
+    while True:
+        try:
+            # Пачками, отдавая управление между ними: первый перенос накопившихся
+            # за годы напоминаний не должен надолго останавливать планировщик
+            while db.archive_expired(limit=ARCHIVE_BATCH_SIZE)['archived'] == ARCHIVE_BATCH_SIZE:
+                await asyncio.sleep(0)
+        except Exception as e:
+            logger.error("Error archiving expired reminders: %s", e)
+        await asyncio.sleep(RETENTION_INTERVAL)
+
+async def stop_background_tasks():
+    global flusher_task
+    # Порядок важен: сначала планировщик перестаёт ставить сообщения, затем очередь
+    # отправляет уже поставленные, и только потом хранилище пишет снимок
+    logger.info("Shutting down: %s messages waiting for delivery", len(delivery_queue))
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    background_tasks.clear()
+    await delivery_queue.stop(timeout=SHUTDOWN_TIMEOUT)
+    # Отменённая посреди записи задача оставила бы поток, пишущий файл, и close()
+    # пошёл бы одновременно с ним: дожидаемся, пока она сама допишет изменения
+    if flusher_task is not None:
+        db.storage.stop_flusher()
+        await flusher_task
+        flusher_task = None
+    db.storage.close()
+    logger.info("Shutdown complete")
+
+def report_missed_reminders(missed, now=None, path=DOWNTIME_REPORT_FILE):
+    """Отчёт о напоминаниях, время которых прошло во время простоя.
+
+    Пишется в лог и в JSON-файл path; для каждого напоминания указано, отправит
+    ли его планировщик сейчас (catch_up) или по политике CATCHUP_POLICY пропустит (skip).
+    """
+    if not missed:
+        return None
+    now = now if now is not None else time.time()
+    entries = []
+    for reminder, missed_at in sorted(missed, key=lambda item: item[1]):
+        fire_at = reminder.next_fire_at
+        entries.append({
+            'id': reminder.id,
+            'user_id': reminder.user_id,
+            'text': reminder.text,
+            'missed_at': datetime.datetime.fromtimestamp(missed_at, datetime.timezone.utc).isoformat(),
+            'action': 'catch_up' if fire_at is not None and fire_at <= now else 'skip',
+            'next_fire_at': None if fire_at is None else
+            datetime.datetime.fromtimestamp(fire_at, datetime.timezone.utc).isoformat(),
+        })
+    caught_up = sum(entry['action'] == 'catch_up' for entry in entries)
+    logger.warning("%s reminders were missed during downtime (earliest at %s): %s will be sent now, "
+                   "%s skipped by catch-up policy %r", len(entries), entries[0]['missed_at'],
+                   caught_up, len(entries) - caught_up, CATCHUP_POLICY)
+    report = {
+        'generated_at': datetime.datetime.fromtimestamp(now, datetime.timezone.utc).isoformat(),
+        'policy': CATCHUP_POLICY,
+        'missed': entries,
+    }
+    if path:
+        try:
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+            logger.info("Downtime report written to %s", path)
+        except OSError as e:
+            logger.error("Error writing downtime report %s: %s", path, e)
+    return report
+
+@dp.startup()
+async def on_startup(bot: Bot):
+    start_background_tasks()
+    
+    if BOT_MODE == 'webhook':
+        await bot.set_webhook(f"{WEBHOOK_BASE_URL.rstrip('/')}{WEBHOOK_PATH}", secret_token=WEBHOOK_SECRET,
+                              drop_pending_updates=False)
+        logger.info("Webhook set to %s%s", WEBHOOK_BASE_URL.rstrip('/'), WEBHOOK_PATH)
+
+@dp.shutdown()
+async def on_shutdown():
+    await stop_background_tasks()
+
+# Проверка работоспособности для режима вебхука
+async def health(request):
+    return web.json_response({
+        'status': 'ok',
+        'mode': BOT_MODE,
+        'scheduled_reminders': len(reminder_scheduler),
+        'pending_deliveries': len(delivery_queue),
+    })
+
+def create_webhook_app(secret_token=WEBHOOK_SECRET):
+    """Создаёт aiohttp-приложение, принимающее обновления Telegram на WEBHOOK_PATH"""
+    app = web.Application()
+    SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=secret_token).register(app, path=WEBHOOK_PATH)
+    app.router.add_get('/health', health)
+    metrics.add_metrics_route(app)
+    setup_application(app, dp, bot=bot)
+    return app
+
+async def run_webhook():
+    if not WEBHOOK_BASE_URL:
+        raise RuntimeError("WEBHOOK_BASE_URL is required in webhook mode")
+    # Без секрета кто угодно может прислать поддельное обновление от имени любого пользователя
+    if not WEBHOOK_SECRET:
+        raise RuntimeError("WEBHOOK_SECRET is required in webhook mode")
+    
+    runner = web.AppRunner(create_webhook_app())
+    await runner.setup()
+    await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+    logger.info("Listening for webhook updates on %s:%s%s", WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH)
+    
+    try:
+        await wait_for_stop_signal()
+    finally:
+        await runner.cleanup()
+
+async def run_worker():
+    """Только планировщик и отправка, без приёма обновлений"""
+    start_background_tasks()
+    try:
+        await wait_for_stop_signal()
+    finally:
+        await stop_background_tasks()
+        await bot.session.close()
+
+async def wait_for_stop_signal():
+    # docker stop присылает SIGTERM - завершаемся штатно, с остановкой планировщика
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            pass
+    await stop.wait()
 
 # Запуск бота
 async def main():
-    logger.info("Starting Napominalkin Bot...")
+    logger.info("Starting Napominalkin Bot in %s mode, role %s...", BOT_MODE, BOT_ROLE)
+    if BOT_ROLE != 'bot':
+        report_missed_reminders(db.missed)
+    db.missed.clear()
     
-    # Запускаем планировщик в фоне
-    asyncio.create_task(scheduler())
+    # В режиме вебхука /metrics отдаёт тот же HTTP-сервер, иначе поднимаем отдельный
+    metrics_runner = None
+    if BOT_ROLE == 'worker' or BOT_MODE != 'webhook':
+        metrics_runner = await metrics.start_metrics_server()
     
-    # Запускаем бота
-    await dp.start_polling(bot)
+    try:
+        if BOT_ROLE == 'worker':
+            await run_worker()
+        elif BOT_MODE == 'webhook':
+            await run_webhook()
+        else:
+            # Оставшийся от режима вебхука вебхук мешает получать обновления опросом
+            await bot.delete_webhook()
+            await dp.start_polling(bot)
+    finally:
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
 
 if __name__ == "__main__":
     asyncio.run(main())
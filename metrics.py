@@ -0,0 +1,170 @@
+import bisect
+import os
+
+from aiohttp import web
+
+# Метрики выключены по умолчанию: тогда все счётчики - пустые заглушки
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', '0') not in ('0', 'false', 'no')
+METRICS_HOST = os.getenv('METRICS_HOST', '0.0.0.0')
+METRICS_PORT = int(os.getenv('METRICS_PORT', 9090))
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Границы корзин гистограмм, в секундах
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+LATENESS_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900, 3600)
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    type = 'counter'
+
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def samples(self):
+        yield self.name, '', self.value
+
+
+class Gauge:
+    """Текущее значение; если задана функция, значение считается при чтении метрик"""
+
+    type = 'gauge'
+
+    def __init__(self, name, documentation, function=None):
+        self.name = name
+        self.documentation = documentation
+        self.function = function
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+    def set_function(self, function):
+        self.function = function
+
+    def samples(self):
+        yield self.name, '', self.function() if self.function is not None else self.value
+
+
+class Histogram:
+    type = 'histogram'
+
+    def __init__(self, name, documentation, buckets=DURATION_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self):
+        cumulative = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            cumulative += count
+            yield f'{self.name}_bucket', f'{{le="{bound}"}}', cumulative
+        yield f'{self.name}_sum', '', self.sum
+        yield f'{self.name}_count', '', self.count
+
+
+class _NoopMetric:
+    """Заглушка выключенных метрик: вызовы ничего не делают"""
+
+    def inc(self, amount=1):
+        pass
+
+    def set(self, value):
+        pass
+
+    def set_function(self, function):
+        pass
+
+    def observe(self, value):
+        pass
+
+
+NOOP = _NoopMetric()
+
+
+class Registry:
+    def __init__(self, enabled=METRICS_ENABLED):
+        self.enabled = enabled
+        self._metrics = []
+
+    def _register(self, metric):
+        if not self.enabled:
+            return NOOP
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation):
+        return self._register(Counter(name, documentation))
+
+    def gauge(self, name, documentation, function=None):
+        return self._register(Gauge(name, documentation, function))
+
+    def histogram(self, name, documentation, buckets=DURATION_BUCKETS):
+        return self._register(Histogram(name, documentation, buckets))
+
+    def render(self):
+        """Метрики в текстовом формате Prometheus"""
+        lines = []
+        for metric in self._metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            for name, labels, value in metric.samples():
+                lines.append(f'{name}{labels} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+REMINDERS_CREATED = registry.counter('napominalkin_reminders_created_total', 'Created reminders')
+REMINDERS_TOGGLED = registry.counter('napominalkin_reminders_toggled_total', 'Paused or resumed reminders')
+REMINDERS_DELETED = registry.counter('napominalkin_reminders_deleted_total', 'Deleted reminders')
+REMINDERS_SNOOZED = registry.counter('napominalkin_reminders_snoozed_total', 'Snoozed notifications')
+REMINDERS_ARCHIVED = registry.counter('napominalkin_reminders_archived_total', 'Expired reminders moved to the archive')
+ARCHIVED_BYTES = registry.counter('napominalkin_archived_bytes_total',
+                                  'Serialized size of reminders moved out of the working set')
+MESSAGES_SENT = registry.counter('napominalkin_messages_sent_total', 'Messages delivered to Telegram')
+MESSAGES_FAILED = registry.counter('napominalkin_messages_failed_total', 'Messages moved to dead letters')
+TICK_DURATION = registry.histogram('napominalkin_scheduler_tick_seconds', 'Duration of a scheduler tick')
+FIRE_LATENESS = registry.histogram('napominalkin_fire_lateness_seconds',
+                                   'Delivery time minus scheduled fire time', LATENESS_BUCKETS)
+API_LATENCY = registry.histogram('napominalkin_bot_api_latency_seconds', 'Duration of Bot API send requests')
+ACTIVE_REMINDERS = registry.gauge('napominalkin_active_reminders', 'Reminders waiting in the scheduler')
+DELIVERY_QUEUE_DEPTH = registry.gauge('napominalkin_delivery_queue_depth', 'Messages waiting to be delivered')
+STORE_SIZE = registry.gauge('napominalkin_store_reminders', 'Reminders held in the store')
+
+
+async def metrics_handler(request):
+    return web.Response(body=registry.render().encode('utf-8'), headers={'Content-Type': CONTENT_TYPE})
+
+
+def add_metrics_route(app, path='/metrics'):
+    if registry.enabled:
+        app.router.add_get(path, metrics_handler)
+
+
+async def start_metrics_server(host=METRICS_HOST, port=METRICS_PORT):
+    """Отдельный HTTP-сервер метрик (для режима polling и воркеров); None, если метрики выключены"""
+    if not registry.enabled:
+        return None
+    app = web.Application()
+    add_metrics_route(app)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
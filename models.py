@@ -0,0 +1,136 @@
+import datetime
+import html
+import sys
+
+from recurrence import DEFAULT_TIMEZONE, Repeat, days_to_mask, from_wall, get_zone, mask_to_days, to_wall
+
+# Поля, которые Reminder хранит сам; остальные ключи JSON сохраняются в extra как есть
+FIELDS = frozenset(('id', 'user_id', 'text', 'datetime', 'timezone', 'repeat', 'days', 'active',
+                    'created_at', 'next_fire_at', 'last_fired_at', 'paused_at'))
+_REPEATS = {repeat.value: repeat for repeat in Repeat}
+
+
+class Reminder:
+    """Напоминание в памяти.
+
+    Вместо словаря со строками ISO хранит времена целыми числами, повторение -
+    значением Repeat, а дни недели - 7-битной маской (Вс=0 ... Сб=6), поэтому
+    занимает заметно меньше памяти и не разбирается при планировании.
+    В хранилище и экспорт попадает прежний JSON-формат (to_dict/from_dict);
+    для чтения по-прежнему работает reminder['text'] и reminder.get('days').
+    """
+
+    __slots__ = ('id', 'user_id', 'text', 'text_html', 'wall', 'timezone', 'repeat', 'days_mask', 'active',
+                 'created_at', 'next_fire_at', 'last_fired_at', 'paused_at', 'extra')
+
+    def __init__(self, id=None, user_id=None, text='', wall=0, timezone=None, repeat=Repeat.NONE, days_mask=0,
+                 active=True, created_at=None, next_fire_at=None, last_fired_at=None, paused_at=None, extra=None,
+                 text_html=None):
+        self.id = id
+        self.user_id = user_id
+        self.text = text
+        # Текст для сообщений с parse_mode=HTML экранируется один раз; без спецсимволов
+        # escape возвращает ту же строку, и лишней памяти запись не занимает
+        self.text_html = html.escape(text, quote=False) if text_html is None else text_html
+        self.wall = wall                    # местное время напоминания, см. recurrence.to_wall
+        self.timezone = timezone
+        self.repeat = repeat
+        self.days_mask = days_mask
+        self.active = active
+        self.created_at = created_at        # UTC epoch-секунды
+        self.next_fire_at = next_fire_at
+        self.last_fired_at = last_fired_at
+        self.paused_at = paused_at          # когда пользователь приостановил напоминание, UTC epoch-секунды
+        self.extra = extra
+
+    @classmethod
+    def from_dict(cls, data):
+        """Создаёт запись из JSON-формата (данные Web App, файлы, строки SQLite)"""
+        timezone = data.get('timezone') or None
+        if timezone is not None:
+            # Строки поясов повторяются у миллионов записей - храним одну копию
+            timezone = sys.intern(timezone)
+        value = datetime.datetime.fromisoformat(data['datetime'])
+        if value.tzinfo is not None:
+            # Старые записи могли сохраниться со смещением - переводим в пояс напоминания
+            value = value.astimezone(get_zone(timezone or DEFAULT_TIMEZONE)).replace(tzinfo=None)
+        extra_keys = data.keys() - FIELDS
+        return cls(
+            id=data.get('id'),
+            user_id=data.get('user_id'),
+            text=data.get('text', ''),
+            wall=to_wall(value),
+            timezone=timezone,
+            repeat=_REPEATS.get(data.get('repeat'), Repeat.NONE),
+            days_mask=days_to_mask(data.get('days')),
+            active=bool(data.get('active', True)),
+            created_at=_parse_created_at(data.get('created_at')),
+            next_fire_at=data.get('next_fire_at'),
+            last_fired_at=data.get('last_fired_at'),
+            paused_at=data.get('paused_at'),
+            extra={key: data[key] for key in extra_keys} if extra_keys else None,
+        )
+
+    def to_dict(self):
+        """Запись в прежнем JSON-формате"""
+        data = {
+            'text': self.text,
+            'datetime': from_wall(self.wall).isoformat(),
+            'repeat': self.repeat.value,
+            'days': mask_to_days(self.days_mask),
+            'user_id': self.user_id,
+            'id': self.id,
+            'active': self.active,
+            'next_fire_at': self.next_fire_at,
+        }
+        if self.timezone is not None:
+            data['timezone'] = self.timezone
+        if self.created_at is not None:
+            data['created_at'] = datetime.datetime.fromtimestamp(self.created_at).isoformat()
+        if self.last_fired_at is not None:
+            data['last_fired_at'] = self.last_fired_at
+        if self.paused_at is not None:
+            data['paused_at'] = self.paused_at
+        if self.extra:
+            data.update(self.extra)
+        return data
+
+    def copy(self):
+        return Reminder(**{name: getattr(self, name) for name in self.__slots__})
+
+    @property
+    def days(self):
+        return mask_to_days(self.days_mask)
+
+    # Доступ на чтение как к словарю - для кода, общего с данными Web App
+    def __getitem__(self, key):
+        if key == 'datetime':
+            return from_wall(self.wall).isoformat()
+        if key == 'days':
+            return self.days
+        if key == 'created_at':
+            return None if self.created_at is None else datetime.datetime.fromtimestamp(self.created_at).isoformat()
+        if key in FIELDS:
+            return getattr(self, key)
+        if self.extra and key in self.extra:
+            return self.extra[key]
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        try:
+            value = self[key]
+        except KeyError:
+            return default
+        return default if value is None else value
+
+    def __repr__(self):
+        return f"Reminder(id={self.id!r}, user_id={self.user_id!r}, text={self.text!r})"
+
+
+def _parse_created_at(value):
+    if value is None:
+        return None
+    try:
+        return int(datetime.datetime.fromisoformat(value).timestamp())
+    except (TypeError, ValueError):
+        return None
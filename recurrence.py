@@ -0,0 +1,193 @@
+import datetime
+import enum
+import functools
+import os
+import zoneinfo
+
+
+class Repeat(str, enum.Enum):
+    """Тип повторения; наследуется от str, поэтому сравнивается со строками и пишется в JSON как есть"""
+
+    NONE = 'none'
+    DAILY = 'daily'
+    WEEKLY = 'weekly'
+    CUSTOM = 'custom'
+
+
+REPEAT_TYPES = tuple(repeat.value for repeat in Repeat)
+
+# Политика догоняющей отправки для срабатываний, пропущенных во время простоя:
+#   skip - пропущенные не отправляются, ждём следующего срабатывания
+#   once - отправляется одно (самое раннее) пропущенное, остальные пропускаются
+#   all  - отправляются все пропущенные в пределах окна CATCHUP_WINDOW
+CATCHUP_POLICIES = ('skip', 'once', 'all')
+CATCHUP_POLICY = os.getenv('CATCHUP_POLICY', 'once')
+CATCHUP_WINDOW = int(os.getenv('CATCHUP_WINDOW', 6 * 3600))
+
+# Часовой пояс пользователей, которые его не указали
+DEFAULT_TIMEZONE = os.getenv('DEFAULT_TIMEZONE', 'Europe/Moscow')
+
+# Варианты «Отложить» у уведомления: через 10 минут, через час, завтра в то же время
+SNOOZE_OPTIONS = ('10m', '1h', 'tomorrow')
+_SNOOZE_DELAYS = {'10m': 600, '1h': 3600}
+
+# Опоздание в пределах этого окна пропуском не считается
+# (Web App отдаёт время с точностью до минуты)
+GRACE_PERIOD = 60
+
+
+def web_weekday(day):
+    """Номер дня недели в формате Web App: Вс=0, Пн=1, ..., Сб=6"""
+    return (day.weekday() + 1) % 7
+
+
+def days_to_mask(days):
+    """Список дней недели (Вс=0 ... Сб=6) в 7-битную маску; некорректные дни пропускаются"""
+    mask = 0
+    for day in days or ():
+        if isinstance(day, int) and 0 <= day <= 6:
+            mask |= 1 << day
+    return mask
+
+
+def mask_to_days(mask):
+    """Маска дней недели обратно в отсортированный список или None"""
+    return [day for day in range(7) if mask >> day & 1] or None
+
+
+# Местное время хранится числом: секунды от 1970-01-01 00:00 по «настенным часам»,
+# без привязки к поясу, поэтому смена пояса не сдвигает время напоминания
+_WALL_EPOCH = datetime.datetime(1970, 1, 1)
+_SECOND = datetime.timedelta(seconds=1)
+
+
+def to_wall(value):
+    """Naive datetime в секунды местного времени"""
+    return (value - _WALL_EPOCH) // _SECOND
+
+
+def from_wall(wall):
+    return _WALL_EPOCH + datetime.timedelta(seconds=wall)
+
+
+@functools.lru_cache(maxsize=None)
+def get_zone(name):
+    """ZoneInfo по имени IANA; ValueError для неизвестного пояса"""
+    try:
+        return zoneinfo.ZoneInfo(name)
+    except (zoneinfo.ZoneInfoNotFoundError, ValueError) as e:
+        raise ValueError(f"Unknown timezone: {name}") from e
+
+
+def is_valid_timezone(name):
+    try:
+        get_zone(name)
+    except (ValueError, TypeError):
+        return False
+    return True
+
+
+def local_datetime(reminder):
+    """Дата и время напоминания в часовом поясе напоминания (aware datetime)"""
+    zone = get_zone(reminder.get('timezone') or DEFAULT_TIMEZONE)
+    wall = getattr(reminder, 'wall', None)
+    if wall is not None:
+        # Запись Reminder хранит время числом - строку разбирать не нужно
+        return from_wall(wall).replace(tzinfo=zone)
+    value = datetime.datetime.fromisoformat(reminder['datetime'])
+    if value.tzinfo is None:
+        return value.replace(tzinfo=zone)
+    # Старые записи могли сохраниться со смещением - переводим в пояс пользователя
+    return value.astimezone(zone)
+
+
+def _at(anchor, day):
+    # Время суток берётся в поясе напоминания, смещение (и переход на летнее время)
+    # вычисляется zoneinfo для конкретного дня
+    return int(datetime.datetime.combine(day, anchor.time(), tzinfo=anchor.tzinfo).timestamp())
+
+
+def next_occurrence(reminder, after=None):
+    """Первое срабатывание строго позже after (UTC epoch-секунды) или None.
+
+    При after=None отсчёт идёт от самой даты напоминания включительно.
+    """
+    anchor = local_datetime(reminder)
+    repeat = reminder.get('repeat', 'none')
+    anchor_ts = int(anchor.timestamp())
+    if after is None:
+        after = anchor_ts - 1
+
+    if repeat == 'none':
+        return anchor_ts if anchor_ts > after else None
+
+    start = max(anchor.date(), datetime.datetime.fromtimestamp(after, tz=anchor.tzinfo).date())
+
+    if repeat == 'daily':
+        candidate = _at(anchor, start)
+        if candidate <= after:
+            candidate = _at(anchor, start + datetime.timedelta(days=1))
+        return candidate
+
+    if repeat == 'weekly':
+        weeks = -(-(start - anchor.date()).days // 7)
+        day = anchor.date() + datetime.timedelta(weeks=weeks)
+        candidate = _at(anchor, day)
+        if candidate <= after:
+            candidate = _at(anchor, day + datetime.timedelta(weeks=1))
+        return candidate
+
+    if repeat == 'custom':
+        mask = getattr(reminder, 'days_mask', None)
+        if mask is None:
+            mask = days_to_mask(reminder.get('days'))
+        if not mask:
+            return None
+        for offset in range(8):
+            day = start + datetime.timedelta(days=offset)
+            if mask >> web_weekday(day) & 1:
+                candidate = _at(anchor, day)
+                if candidate > after:
+                    return candidate
+        return None
+
+    return None
+
+
+def snooze_time(option, now, timezone=None):
+    """Время (UTC epoch-секунды), на которое откладывается уведомление; ValueError для неизвестного варианта"""
+    if option == 'tomorrow':
+        # Сложение с aware datetime идёт по местным часам: переход на летнее время не сдвигает время
+        local = datetime.datetime.fromtimestamp(now, get_zone(timezone or DEFAULT_TIMEZONE))
+        return int((local + datetime.timedelta(days=1)).timestamp())
+    if option not in _SNOOZE_DELAYS:
+        raise ValueError(f"Unknown snooze option: {option}")
+    return int(now) + _SNOOZE_DELAYS[option]
+
+
+def schedule_time(reminder, now, policy=None, window=None):
+    """Время, на которое напоминание ставится в очередь, с учётом пропусков.
+
+    Если ближайшее срабатывание уже прошло (бот был выключен), решение
+    принимается по политике догоняющей отправки.
+    """
+    policy = policy or CATCHUP_POLICY
+    window = CATCHUP_WINDOW if window is None else window
+
+    pending = next_occurrence(reminder, reminder.get('last_fired_at'))
+    if pending is None or pending >= now - GRACE_PERIOD:
+        return pending
+
+    if policy == 'all' and pending < now - window:
+        pending = next_occurrence(reminder, now - window)
+    if policy == 'skip' or pending is None or pending < now - window:
+        return next_occurrence(reminder, now)
+    return pending
+
+
+def advance(reminder, fired_at, now, policy=None):
+    """Следующее срабатывание после отправки напоминания, запланированного на fired_at"""
+    policy = policy or CATCHUP_POLICY
+    if policy == 'all':
+        return next_occurrence(reminder, max(fired_at, now - CATCHUP_WINDOW))
+    return next_occurrence(reminder, max(fired_at, now))
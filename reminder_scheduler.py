@@ -0,0 +1,86 @@
+import asyncio
+import heapq
+import time
+
+# Максимальное время сна планировщика: страхует от перевода системных часов
+MAX_SLEEP = 60
+
+
+class ReminderScheduler:
+    """Очередь напоминаний (min-heap), упорядоченная по времени следующего срабатывания.
+
+    Удаление и перепланирование ленивые: устаревшие записи кучи отбрасываются
+    при извлечении, поэтому каждая операция стоит O(log N).
+    """
+
+    def __init__(self):
+        self._heap = []      # (fire_at, seq, key, reminder)
+        self._entries = {}   # key -> seq актуальной записи кучи
+        self._seq = 0
+        self._wakeup = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def schedule(self, key, fire_at, reminder):
+        """Ставит (или переставляет) напоминание на время fire_at"""
+        self._seq += 1
+        earliest = self.next_fire_at()
+        self._entries[key] = self._seq
+        heapq.heappush(self._heap, (fire_at, self._seq, key, reminder))
+        if earliest is None or fire_at < earliest:
+            self._notify()
+        self._maybe_compact()
+
+    def unschedule(self, key):
+        """Убирает напоминание из очереди"""
+        self._entries.pop(key, None)
+
+    def clear(self):
+        self._heap.clear()
+        self._entries.clear()
+
+    def next_fire_at(self):
+        """Время ближайшего срабатывания или None, если очередь пуста"""
+        while self._heap:
+            fire_at, seq, key, _ = self._heap[0]
+            if self._entries.get(key) == seq:
+                return fire_at
+            heapq.heappop(self._heap)
+        return None
+
+    def pop_due(self, now=None):
+        """Извлекает все напоминания, время которых наступило"""
+        now = now if now is not None else time.time()
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            fire_at, seq, key, reminder = heapq.heappop(self._heap)
+            if self._entries.get(key) != seq:
+                continue
+            del self._entries[key]
+            due.append((key, fire_at, reminder))
+        return due
+
+    async def wait(self):
+        """Спит до ближайшего срабатывания или до изменения очереди"""
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        next_fire = self.next_fire_at()
+        delay = MAX_SLEEP if next_fire is None else min(max(next_fire - time.time(), 0), MAX_SLEEP)
+        if delay <= 0:
+            return
+        self._wakeup.clear()
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+        except asyncio.TimeoutError:
+            pass
+
+    def _notify(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def _maybe_compact(self):
+        # Если устаревших записей стало слишком много, пересобираем кучу
+        if len(self._heap) > 64 and len(self._heap) > 2 * len(self._entries):
+            self._heap = [entry for entry in self._heap if self._entries.get(entry[2]) == entry[1]]
+            heapq.heapify(self._heap)
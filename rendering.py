@@ -0,0 +1,127 @@
+"""
+Тексты сообщений бота: уведомления, подтверждение создания и карточки списка
+
+Шаблоны - строковые константы; уведомление (их тысячи в минуту) собирается
+склейкой заранее разрезанного шаблона. Описания повторений и даты кэшируются,
+имена пользователей экранируются один раз, а текст напоминания экранирует
+для HTML сам Reminder при создании.
+"""
+
+import functools
+import html
+
+from models import Reminder
+from recurrence import Repeat, from_wall, mask_to_days
+
+DAY_NAMES = ('Вс', 'Пн', 'Вт', 'Ср', 'Чт', 'Пт', 'Сб')
+DEFAULT_NAME = 'Друг'
+
+NOTIFICATION_TEMPLATE = """
+🔔 <b>Напоминалкин напоминает!</b>
+
+Помнишь то что ты указал "{text}"?
+Так вот, напоминаю тебе, что это нужно сделать сегодня.
+
+Хорошего тебе дня, {name}! 🌟
+        """
+
+CONFIRMATION_TEMPLATE = """
+✅ <b>Напоминание создано!</b>
+
+📝 <b>Текст:</b> {text}
+📅 <b>Дата:</b> {date}
+⏰ <b>Время:</b> {time}
+🔄 <b>Повторение:</b> {repeat}
+
+💡 Бот пришлёт уведомление в назначенное время!
+        """
+
+CARD_TEMPLATE = "\n<b>{number}.</b> 📝 <b>{text}</b>\n📅 {date} ⏰ {time} {status}\n{repeat}"
+ARCHIVE_TEMPLATE = "• {text} - {date} {time}, {status}"
+ARCHIVE_STATUSES = {'fired': "✅ отправлено", 'paused': "⏸️ было на паузе"}
+# Сколько символов текста показывает карточка списка и строка архива: страница из пяти
+# напоминаний по 1000 символов (и 20 строк архива) не уместилась бы в сообщение (4096 символов)
+CARD_TEXT_LIMIT = 200
+ARCHIVE_TEXT_LIMIT = 100
+
+# Время суток «ЧЧ:ММ» для каждой минуты - вместо strftime
+_TIMES = tuple(f"{hour:02d}:{minute:02d}" for hour in range(24) for minute in range(60))
+_DAY = 24 * 3600
+
+
+def _split(template, *fields):
+    """Разрезает шаблон по полям заранее: подстановка - склейка готовых кусков"""
+    parts = []
+    for field in fields:
+        head, _, template = template.partition('{' + field + '}')
+        parts.append(head)
+    parts.append(template)
+    return parts
+
+
+_NOTIFICATION_PARTS = _split(NOTIFICATION_TEMPLATE, 'text', 'name')
+
+
+@functools.lru_cache(maxsize=None)
+def repeat_text(repeat, days_mask=0):
+    """Описание повторения; всего несколько десятков вариантов (тип, маска дней)"""
+    if repeat == Repeat.DAILY:
+        return "🔄 Ежедневно"
+    if repeat == Repeat.WEEKLY:
+        return "📅 Еженедельно"
+    if repeat == Repeat.CUSTOM and days_mask:
+        return f"📌 По дням: {', '.join(DAY_NAMES[day] for day in mask_to_days(days_mask))}"
+    return "⏰ Один раз"
+
+
+@functools.lru_cache(maxsize=4096)
+def _format_day(day):
+    return from_wall(day * _DAY).strftime("%d.%m.%Y")
+
+
+def format_date(wall):
+    """Дата напоминания «ДД.ММ.ГГГГ» по местному времени (см. recurrence.to_wall)"""
+    return _format_day(wall // _DAY)
+
+
+def format_time(wall):
+    return _TIMES[wall % _DAY // 60]
+
+
+@functools.lru_cache(maxsize=65536)
+def user_name(first_name):
+    """Имя для обращения, экранированное для HTML (кэшируется по имени пользователя)"""
+    return html.escape(first_name or DEFAULT_NAME, quote=False)
+
+
+def _short_html(reminder, limit):
+    """Текст для HTML, обрезанный до limit символов с «…» (обрезается до экранирования)"""
+    if len(reminder.text) <= limit:
+        return reminder.text_html
+    return html.escape(reminder.text[:limit - 1].rstrip() + '…', quote=False)
+
+
+def render_notification(reminder, user):
+    head, middle, tail = _NOTIFICATION_PARTS
+    return head + reminder.text_html + middle + user_name(user.get('first_name')) + tail
+
+
+def render_confirmation(reminder):
+    return CONFIRMATION_TEMPLATE.format(text=reminder.text_html, date=format_date(reminder.wall),
+                                        time=format_time(reminder.wall),
+                                        repeat=repeat_text(reminder.repeat, reminder.days_mask))
+
+
+def render_card(number, reminder):
+    """Карточка напоминания в списке /my_reminders"""
+    return CARD_TEMPLATE.format(number=number, text=_short_html(reminder, CARD_TEXT_LIMIT), date=format_date(reminder.wall),
+                                time=format_time(reminder.wall), status="✅" if reminder.active else "⏸️",
+                                repeat=repeat_text(reminder.repeat, reminder.days_mask))
+
+
+def render_archive_entry(record):
+    """Строка /history для записи архива (см. retention.archive_record)"""
+    reminder = Reminder.from_dict(record)
+    return ARCHIVE_TEMPLATE.format(text=_short_html(reminder, ARCHIVE_TEXT_LIMIT), date=format_date(reminder.wall),
+                                   time=format_time(reminder.wall),
+                                   status=ARCHIVE_STATUSES.get(record.get('reason'), "🗄 в архиве"))
@@ -0,0 +1,48 @@
+import os
+
+from recurrence import Repeat
+
+# Сколько секунд неактивные напоминания остаются в рабочем наборе, прежде чем уйти в архив
+# (0 - не архивировать): отправленные разовые и приостановленные пользователем
+RETENTION_FIRED_TTL = int(os.getenv('RETENTION_FIRED_TTL', 30 * 24 * 3600))
+RETENTION_PAUSED_TTL = int(os.getenv('RETENTION_PAUSED_TTL', 0))
+# Как часто фоновая задача ищет истёкшие напоминания, в секундах (0 - задача не запускается)
+RETENTION_INTERVAL = float(os.getenv('RETENTION_INTERVAL', 3600))
+# Сколько напоминаний переносится в архив одной записью
+ARCHIVE_BATCH_SIZE = 1000
+
+FIRED = 'fired'
+PAUSED = 'paused'
+
+
+def is_paused(reminder):
+    """Неактивное напоминание приостановил пользователь, а не отключил планировщик после отправки"""
+    if reminder.active:
+        return False
+    # Разовое напоминание планировщик отключает сам; у старых записей нет paused_at
+    return reminder.repeat is not Repeat.NONE or (reminder.last_fired_at is None and reminder.paused_at is not None)
+
+
+def expiry_reason(reminder, now, fired_ttl=None, paused_ttl=None):
+    """FIRED или PAUSED, если неактивное напоминание пора перенести в архив, иначе None"""
+    if reminder.active:
+        return None
+    fired_ttl = RETENTION_FIRED_TTL if fired_ttl is None else fired_ttl
+    paused_ttl = RETENTION_PAUSED_TTL if paused_ttl is None else paused_ttl
+    if is_paused(reminder):
+        reason, ttl, since = PAUSED, paused_ttl, reminder.paused_at
+    else:
+        reason, ttl, since = FIRED, fired_ttl, reminder.last_fired_at
+    # У старых записей нет времени отправки или паузы - отсчитываем от создания
+    since = since if since is not None else reminder.created_at
+    if not ttl or since is None or now - since < ttl:
+        return None
+    return reason
+
+
+def archive_record(reminder, reason, archived_at):
+    """Запись архива: напоминание в JSON-формате, причина и время переноса"""
+    data = reminder.to_dict()
+    data['archived_at'] = archived_at
+    data['reason'] = reason
+    return data
@@ -0,0 +1,147 @@
+import logging
+import math
+import os
+import socket
+import sqlite3
+import time
+
+logger = logging.getLogger(__name__)
+
+# 0 - шардирование выключено, планировщик работает в одном процессе по очереди в памяти
+SHARD_COUNT = int(os.getenv('SHARD_COUNT', 0))
+LEASE_TTL = float(os.getenv('LEASE_TTL', 30))
+LEASE_DB = os.getenv('LEASE_DB') or os.getenv('SQLITE_PATH', 'napominalkin.db')
+WORKER_ID = os.getenv('WORKER_ID') or f"{socket.gethostname()}-{os.getpid()}"
+# Сколько хранить ключи идемпотентности отправок
+DELIVERY_KEY_TTL = 7 * 24 * 3600
+
+
+def delivery_key(reminder, fire_at):
+    """Ключ идемпотентности: одно срабатывание напоминания отправляется один раз"""
+    return f"{reminder['id']}:{int(fire_at)}"
+
+
+class LeaseStore:
+    """Аренды шардов и журнал отправок в общем SQLite-файле.
+
+    Все изменения аренд идут в транзакциях BEGIN IMMEDIATE, поэтому несколько
+    процессов (и контейнеров с общим томом) не могут захватить один шард.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS shard_leases (
+            shard INTEGER PRIMARY KEY,
+            owner TEXT,
+            expires_at REAL NOT NULL DEFAULT 0
+        );
+        CREATE TABLE IF NOT EXISTS scheduler_workers (
+            owner TEXT PRIMARY KEY,
+            heartbeat_at REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS deliveries (
+            key TEXT PRIMARY KEY,
+            owner TEXT,
+            delivered_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_deliveries_time ON deliveries (delivered_at);
+    """
+
+    def __init__(self, path=LEASE_DB):
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=10, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.executescript(self.SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def acquire(self, owner, shard_count, ttl=LEASE_TTL, now=None):
+        """Продлевает свои аренды и захватывает свободные шарды до справедливой доли.
+
+        Возвращает множество шардов, которыми владеет owner.
+        """
+        now = now if now is not None else time.time()
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            self.conn.execute(
+                'INSERT INTO scheduler_workers (owner, heartbeat_at) VALUES (?, ?) '
+                'ON CONFLICT (owner) DO UPDATE SET heartbeat_at = excluded.heartbeat_at', (owner, now))
+            self.conn.execute('DELETE FROM scheduler_workers WHERE heartbeat_at < ?', (now - ttl,))
+            workers = self.conn.execute('SELECT COUNT(*) FROM scheduler_workers').fetchone()[0]
+            fair_share = math.ceil(shard_count / max(workers, 1))
+
+            leases = dict.fromkeys(range(shard_count))
+            for shard, lease_owner, expires_at in self.conn.execute(
+                    'SELECT shard, owner, expires_at FROM shard_leases WHERE shard < ?', (shard_count,)):
+                leases[shard] = lease_owner if expires_at >= now else None
+
+            owned = [shard for shard, lease_owner in leases.items() if lease_owner == owner]
+            # Лишние шарды отдаём, чтобы новые воркеры получили свою долю
+            released = owned[fair_share:]
+            owned = owned[:fair_share]
+            free = [shard for shard, lease_owner in leases.items() if lease_owner is None]
+            owned += free[:max(fair_share - len(owned), 0)]
+
+            for shard in released:
+                self.conn.execute('UPDATE shard_leases SET owner = NULL, expires_at = 0 WHERE shard = ? AND owner = ?',
+                                  (shard, owner))
+            for shard in owned:
+                self.conn.execute(
+                    'INSERT INTO shard_leases (shard, owner, expires_at) VALUES (?, ?, ?) '
+                    'ON CONFLICT (shard) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at',
+                    (shard, owner, now + ttl))
+            self.conn.execute('COMMIT')
+        except BaseException:
+            self.conn.execute('ROLLBACK')
+            raise
+        return set(owned)
+
+    def release(self, owner):
+        """Освобождает все аренды воркера (при штатной остановке)"""
+        self.conn.execute('BEGIN IMMEDIATE')
+        self.conn.execute('UPDATE shard_leases SET owner = NULL, expires_at = 0 WHERE owner = ?', (owner,))
+        self.conn.execute('DELETE FROM scheduler_workers WHERE owner = ?', (owner,))
+        self.conn.execute('COMMIT')
+
+    def record_delivery(self, key, owner, now=None):
+        """Регистрирует отправку; False, если она уже была сделана другим воркером"""
+        now = now if now is not None else time.time()
+        cursor = self.conn.execute('INSERT OR IGNORE INTO deliveries (key, owner, delivered_at) VALUES (?, ?, ?)',
+                                   (key, owner, now))
+        return cursor.rowcount == 1
+
+    def prune_deliveries(self, now=None):
+        now = now if now is not None else time.time()
+        self.conn.execute('DELETE FROM deliveries WHERE delivered_at < ?', (now - DELIVERY_KEY_TTL,))
+
+
+class ShardCoordinator:
+    """Держит аренды шардов одного воркера и отвечает, чьи это напоминания"""
+
+    def __init__(self, lease_store, owner=WORKER_ID, shard_count=SHARD_COUNT, ttl=LEASE_TTL):
+        self.lease_store = lease_store
+        self.owner = owner
+        self.shard_count = shard_count
+        self.ttl = ttl
+        self.shards = set()
+        self._renewed_at = 0
+
+    def refresh(self, now=None):
+        """Продлевает аренды не реже, чем раз в треть TTL"""
+        now = now if now is not None else time.time()
+        if now - self._renewed_at < self.ttl / 3:
+            return self.shards
+        shards = self.lease_store.acquire(self.owner, self.shard_count, self.ttl, now)
+        if shards != self.shards:
+            logger.info("Worker %s now owns shards %s", self.owner, sorted(shards))
+        self.shards = shards
+        self._renewed_at = now
+        return shards
+
+    def claim_delivery(self, reminder, fire_at):
+        return self.lease_store.record_delivery(delivery_key(reminder, fire_at), self.owner)
+
+    def release(self):
+        self.lease_store.release(self.owner)
+        self.shards = set()
+        self._renewed_at = 0
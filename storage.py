@@ -0,0 +1,745 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import sys
+import tempfile
+
+from models import Reminder
+from retention import archive_record
+
+logger = logging.getLogger(__name__)
+
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'json')
+REMINDERS_FILE = os.getenv('REMINDERS_FILE', 'reminders.json')
+USERS_FILE = os.getenv('USERS_FILE', 'users.json')
+SQLITE_PATH = os.getenv('SQLITE_PATH', 'napominalkin.db')
+FLUSH_INTERVAL = float(os.getenv('FLUSH_INTERVAL', 1.0))
+# Журнал изменений JSON-хранилища (по умолчанию рядом со снимком: reminders.json.journal)
+# и размер, после которого он сворачивается в новый снимок
+JOURNAL_FILE = os.getenv('JOURNAL_FILE', '')
+JOURNAL_COMPACT_BYTES = int(os.getenv('JOURNAL_COMPACT_BYTES', 4 * 1024 * 1024))
+# Архив напоминаний, ушедших из рабочего набора (по умолчанию reminders.archive.jsonl)
+ARCHIVE_FILE = os.getenv('ARCHIVE_FILE', '')
+# Сколько последних байт JSON-архива просматривает история пользователя (/history)
+ARCHIVE_SCAN_BYTES = int(os.getenv('ARCHIVE_SCAN_BYTES', 8 * 1024 * 1024))
+_ARCHIVE_BLOCK = 64 * 1024
+# Условие списка /my_reminders: активные и приостановленные, без отправленных разовых
+# (то же, что retention.is_paused, по полям JSON-записи)
+_LISTED = ("(active = 1 OR json_extract(data, '$.repeat') != 'none' OR "
+           "(json_extract(data, '$.last_fired_at') IS NULL AND json_extract(data, '$.paused_at') IS NOT NULL))")
+
+
+class CorruptedStorageError(RuntimeError):
+    """Файл хранилища не читается - запуск с пустыми данными затёр бы его"""
+
+
+class Storage:
+    """Интерфейс хранилища, с которым работает Database.
+
+    Каждая мутация сохраняет ровно одну запись; load() возвращает напоминания
+    (Reminder) и словарь пользователей. Напоминания хранилища с resident = True
+    Database держит в памяти; остальные хранилища сами отвечают на выборки
+    (get_reminder, get_user_reminders_page и т.д.), а load() перебирает их лениво.
+    """
+
+    resident = True
+
+    def load(self):
+        raise NotImplementedError
+
+    def save_reminder(self, reminder):
+        raise NotImplementedError
+
+    def delete_reminder(self, reminder):
+        raise NotImplementedError
+
+    def save_user(self, user_id, user):
+        raise NotImplementedError
+
+    def save_reminders(self, reminders, next_id=None):
+        """Сохраняет пачку напоминаний (и счётчик id) одной записью"""
+        raise NotImplementedError
+
+    def get_user_reminders(self, user_id):
+        raise NotImplementedError
+
+    def iter_reminders(self, user_id=None, active=None):
+        """Лениво перебирает напоминания пользователя (или все, если user_id=None).
+
+        active=True/False оставляет только активные или только приостановленные.
+        """
+        raise NotImplementedError
+
+    def count_reminders(self, user_id=None):
+        """Число напоминаний пользователя (или всех), включая приостановленные"""
+        raise NotImplementedError
+
+    def load_sequence(self):
+        """Следующий свободный id напоминания (0, если ещё не сохранялся)"""
+        raise NotImplementedError
+
+    def archive_reminders(self, entries, archived_at):
+        """Переносит напоминания [(напоминание, причина)] в архив и удаляет из хранилища.
+
+        Возвращает размер архивных записей в байтах - столько данных ушло из рабочего набора.
+        """
+        raise NotImplementedError
+
+    def iter_archive(self, user_id=None):
+        """Записи архива (словари с archived_at и reason) в порядке переноса"""
+        raise NotImplementedError
+
+    async def recent_archive(self, user_id, limit):
+        """Последние limit записей архива пользователя, новые первыми; не блокирует цикл событий"""
+        raise NotImplementedError
+
+    def save_sequence(self, next_id):
+        raise NotImplementedError
+
+    def flush(self):
+        """Синхронно сбрасывает отложенные изменения на диск"""
+
+    def compact(self):
+        """Сворачивает накопленный журнал изменений в снимок (если хранилище его ведёт)"""
+
+    async def run_flusher(self, interval=FLUSH_INTERVAL):
+        """Фоновая задача отложенной записи (не нужна хранилищам с построчной записью)"""
+
+    def stop_flusher(self):
+        """Просит run_flusher дописать текущие изменения и завершиться"""
+
+    def close(self):
+        self.flush()
+
+
+class JsonStorage(Storage):
+    """Хранилище в JSON: снимок (reminders.json, users.json) и журнал изменений.
+
+    Мутации копятся в памяти; фоновая задача run_flusher раз в interval секунд
+    дописывает их в журнал (append + fsync) в пуле потоков, а когда журнал
+    вырастает больше compact_bytes, атомарно (временный файл + rename) пишет
+    новый снимок и очищает журнал. При загрузке к снимку применяется журнал,
+    поэтому оборванная на середине запись не портит данные. Пока задача не
+    запущена, запись синхронная.
+    """
+
+    def __init__(self, reminders_file=REMINDERS_FILE, users_file=USERS_FILE, journal_file=None,
+                 compact_bytes=JOURNAL_COMPACT_BYTES, archive_file=None):
+        self.reminders_file = reminders_file
+        self.users_file = users_file
+        self.journal_file = journal_file or JOURNAL_FILE or reminders_file + '.journal'
+        self.archive_file = archive_file or ARCHIVE_FILE or os.path.splitext(reminders_file)[0] + '.archive.jsonl'
+        self.compact_bytes = compact_bytes
+        # Записи хранятся по идентичности объекта: в старых файлах id могут повторяться
+        self._records = {}
+        self._next_id = 0
+        self.users = {}
+        # Изменения, ещё не записанные в журнал: id напоминания -> запись (None - удалена)
+        self._pending = {}
+        self._pending_users = set()
+        self._pending_sequence = False
+        self._journal_size = 0
+        # Номер снимка: журнал начинается строкой с номером снимка, к которому он относится
+        self._generation = 0
+        self._needs_compaction = False
+        self._flusher_running = False
+        self._stop_flusher = None
+
+    def load(self):
+        # Записи создаются прямо при разборе, без промежуточного списка словарей
+        data = _read_json(self.reminders_file, [], object_hook=_reminder_hook)
+        # Старый формат - просто список напоминаний, новый - объект со счётчиком id
+        if isinstance(data, dict):
+            reminders = data.get('reminders', [])
+            self._next_id = data.get('next_id', 0)
+            self._generation = data.get('generation', 0)
+        else:
+            reminders = data
+        self.users = _read_json(self.users_file, {})
+        reminders = self._replay_journal(reminders)
+        self._records = {id(r): r for r in reminders}
+        return reminders, self.users
+
+    def _replay_journal(self, reminders):
+        """Применяет к снимку записи журнала; время работы пропорционально длине журнала"""
+        try:
+            f = open(self.journal_file, 'r', encoding='utf-8')
+        except FileNotFoundError:
+            return reminders
+        entries = 0
+        positions = {reminder.id: index for index, reminder in enumerate(reminders)}
+        with f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # Процесс остановили посреди дозаписи: последняя строка оборвана.
+                    # Всё до неё уже применено, новый снимок уберёт обрывок из журнала
+                    logger.warning("Journal %s ends with a torn entry, ignoring it", self.journal_file)
+                    self._needs_compaction = True
+                    break
+                op = entry.get('op')
+                if op == 'snapshot':
+                    if entry['generation'] != self._generation:
+                        # Остановка между записью снимка и очисткой журнала: всё из журнала
+                        # уже есть в снимке, а применять старые записи поверх новых нельзя
+                        logger.info("Journal %s predates the snapshot, skipping it", self.journal_file)
+                        self._needs_compaction = True
+                        break
+                    continue
+                entries += 1
+                if op == 'put':
+                    reminder = Reminder.from_dict(entry['reminder'])
+                    index = positions.get(reminder.id)
+                    if index is None or reminders[index] is None:
+                        positions[reminder.id] = len(reminders)
+                        reminders.append(reminder)
+                    else:
+                        reminders[index] = reminder
+                elif op == 'delete':
+                    index = positions.pop(entry['id'], None)
+                    if index is not None:
+                        reminders[index] = None
+                elif op == 'user':
+                    self.users[entry['user_id']] = entry['user']
+                elif op == 'sequence':
+                    self._next_id = max(self._next_id, entry['next_id'])
+            self._journal_size = os.fstat(f.fileno()).st_size
+        if entries:
+            logger.info("Replayed %s journal entries from %s", entries, self.journal_file)
+        return [reminder for reminder in reminders if reminder is not None]
+
+    def save_reminder(self, reminder):
+        self._records[id(reminder)] = reminder
+        self._pending[reminder.id] = reminder
+        self._mark_dirty()
+
+    def delete_reminder(self, reminder):
+        # Удаляется только запись, которая есть в хранилище: при перенумерации дублей
+        # сюда приходит копия со старым id, который остаётся у другой записи
+        if self._records.pop(id(reminder), None) is not None:
+            self._pending[reminder.id] = None
+            self._mark_dirty()
+
+    def save_reminders(self, reminders, next_id=None):
+        for reminder in reminders:
+            self._records[id(reminder)] = reminder
+            self._pending[reminder.id] = reminder
+        if next_id is not None:
+            self._next_id = next_id
+            self._pending_sequence = True
+        self._mark_dirty()
+
+    def save_user(self, user_id, user):
+        self.users[user_id] = user
+        self._pending_users.add(user_id)
+        self._mark_dirty()
+
+    def get_user_reminders(self, user_id):
+        return [r for r in self._records.values() if r.user_id == user_id and r.active]
+
+    def iter_reminders(self, user_id=None, active=None):
+        for reminder in list(self._records.values()):
+            if (user_id is None or reminder.user_id == user_id) and (active is None or reminder.active == active):
+                yield reminder
+
+    def count_reminders(self, user_id=None):
+        if user_id is None:
+            return len(self._records)
+        return sum(1 for reminder in self._records.values() if reminder.user_id == user_id)
+
+    def load_sequence(self):
+        return self._next_id
+
+    def save_sequence(self, next_id):
+        self._next_id = next_id
+        self._pending_sequence = True
+        self._mark_dirty()
+
+    def archive_reminders(self, entries, archived_at):
+        # Сначала архив (с fsync), потом удаление: при сбое между ними запись
+        # окажется в архиве дважды, но не потеряется
+        payload = ''.join(json.dumps(archive_record(reminder, reason, archived_at), ensure_ascii=False) + '\n'
+                          for reminder, reason in entries)
+        size = _append(self.archive_file, payload)
+        # Удаления всей пачки попадают в журнал одной записью
+        for reminder, _ in entries:
+            if self._records.pop(id(reminder), None) is not None:
+                self._pending[reminder.id] = None
+        self._mark_dirty()
+        return size
+
+    def iter_archive(self, user_id=None):
+        # Архив читается построчно целиком: он нужен для истории, а не в рабочем цикле
+        try:
+            f = open(self.archive_file, 'r', encoding='utf-8')
+        except FileNotFoundError:
+            return
+        with f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if user_id is None or record.get('user_id') == user_id:
+                    yield record
+
+    async def recent_archive(self, user_id, limit):
+        return await asyncio.get_running_loop().run_in_executor(None, self._read_archive_tail, user_id, limit)
+
+    def _read_archive_tail(self, user_id, limit):
+        # Файл читается блоками с конца и не дальше ARCHIVE_SCAN_BYTES: время ответа
+        # не растёт вместе с архивом, а совсем старые записи в истории не показываются
+        marker = f'"user_id": {json.dumps(user_id)}'.encode('utf-8')
+        try:
+            f = open(self.archive_file, 'rb')
+        except FileNotFoundError:
+            return []
+        records = []
+        with f:
+            position = f.seek(0, os.SEEK_END)
+            stop = max(position - ARCHIVE_SCAN_BYTES, 0)
+            # Начало первой (самой ранней) строки блока - она дочитывается со следующим блоком
+            head = b''
+            while position > stop and len(records) < limit:
+                size = min(_ARCHIVE_BLOCK, position - stop)
+                position -= size
+                f.seek(position)
+                lines = (f.read(size) + head).split(b'\n')
+                head = lines.pop(0) if position > 0 else b''
+                for line in reversed(lines):
+                    if marker not in line:
+                        continue
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    if record.get('user_id') == user_id:
+                        records.append(record)
+                        if len(records) == limit:
+                            break
+        return records
+
+    def flush(self):
+        if self._needs_compaction:
+            self.compact()
+            return
+        payload = self._take_pending()
+        if payload:
+            self._journal_size += _append(self.journal_file, payload)
+        if self._journal_size > self.compact_bytes:
+            self.compact()
+
+    def compact(self):
+        """Пишет новый снимок и очищает журнал"""
+        for path, data in self._take_snapshot():
+            _write_snapshot(path, data)
+        _truncate(self.journal_file)
+        self._journal_size = 0
+
+    async def run_flusher(self, interval=FLUSH_INTERVAL):
+        self._flusher_running = True
+        self._stop_flusher = stopping = asyncio.Event()
+        try:
+            while not stopping.is_set():
+                try:
+                    await asyncio.wait_for(stopping.wait(), interval)
+                except asyncio.TimeoutError:
+                    pass
+                # Отмена задачи не останавливает поток, который пишет файл: шаг записи
+                # доводится до конца, иначе синхронный flush() ниже пойдёт одновременно с ним
+                step = asyncio.ensure_future(self._flush_step())
+                try:
+                    await asyncio.shield(step)
+                except asyncio.CancelledError:
+                    await asyncio.wait([step])
+                    raise
+        finally:
+            self._flusher_running = False
+            self._stop_flusher = None
+            self.flush()
+
+    def stop_flusher(self):
+        if self._stop_flusher is not None:
+            self._stop_flusher.set()
+
+    async def _flush_step(self):
+        # Строки журнала собираются в цикле событий (данные меняются только в нём),
+        # а медленная запись на диск и сериализация снимка идут в пуле потоков
+        loop = asyncio.get_running_loop()
+        try:
+            if not self._needs_compaction:
+                payload = self._take_pending()
+                if payload:
+                    self._journal_size += await loop.run_in_executor(None, _append, self.journal_file, payload)
+            if self._needs_compaction or self._journal_size > self.compact_bytes:
+                # Снимок включает и изменения, сделанные после дозаписи в журнал
+                for path, data in self._take_snapshot():
+                    await loop.run_in_executor(None, _write_snapshot, path, data)
+                await loop.run_in_executor(None, _truncate, self.journal_file)
+                self._journal_size = 0
+        except OSError as e:
+            logger.error("Error writing %s: %s", self.journal_file, e)
+            # Часть изменений могла не попасть на диск - в следующий раз пишем снимок целиком
+            self._needs_compaction = True
+
+    def close(self):
+        # Свежий снимок с пустым журналом - следующий запуск читает только его
+        self.flush()
+        if self._journal_size:
+            self.compact()
+
+    def _mark_dirty(self):
+        if not self._flusher_running:
+            self.flush()
+
+    def _take_pending(self):
+        """Строки журнала для накопленных изменений (пустая строка, если изменений нет)"""
+        lines = []
+        for reminder_id, reminder in self._pending.items():
+            if reminder is None:
+                lines.append(f'{{"op": "delete", "id": {json.dumps(reminder_id)}}}')
+            else:
+                lines.append(json.dumps({'op': 'put', 'reminder': reminder.to_dict()}, ensure_ascii=False))
+        for user_id in self._pending_users:
+            lines.append(json.dumps({'op': 'user', 'user_id': user_id, 'user': self.users[user_id]},
+                                    ensure_ascii=False))
+        if self._pending_sequence:
+            lines.append(json.dumps({'op': 'sequence', 'next_id': self._next_id}))
+        if lines and not self._journal_size:
+            lines.insert(0, json.dumps({'op': 'snapshot', 'generation': self._generation}))
+        self._pending = {}
+        self._pending_users = set()
+        self._pending_sequence = False
+        return ''.join(line + '\n' for line in lines)
+
+    def _take_snapshot(self):
+        # Снимок содержит всё состояние, поэтому накопленные изменения в журнал уже не нужны
+        self._pending = {}
+        self._pending_users = set()
+        self._pending_sequence = False
+        self._needs_compaction = False
+        self._generation += 1
+        # Сериализация идёт в потоке, пока цикл событий меняет данные, поэтому берутся копии
+        # списка записей и словарей пользователей. Запись, изменённая во время сериализации,
+        # уже стоит в _pending и попадёт в журнал после снимка целиком
+        users = {user_id: dict(user) for user_id, user in self.users.items()}
+        snapshot = {'generation': self._generation, 'next_id': self._next_id,
+                    'reminders': list(self._records.values())}
+        # Пользователи пишутся первыми: номер снимка в reminders.json означает, что записаны оба файла
+        return [(self.users_file, users), (self.reminders_file, snapshot)]
+
+
+class SqliteStorage(Storage):
+    """Хранилище в SQLite (WAL): одна строка на напоминание, индексированные выборки.
+
+    Напоминания не загружаются в память целиком: Database читает их отсюда по запросу.
+    """
+
+    resident = False
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS reminders (
+            pk INTEGER PRIMARY KEY AUTOINCREMENT,
+            id INTEGER NOT NULL,
+            user_id INTEGER,
+            active INTEGER NOT NULL DEFAULT 1,
+            next_fire_at REAL,
+            data TEXT NOT NULL
+        );
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_reminders_key ON reminders (user_id, id);
+        CREATE INDEX IF NOT EXISTS idx_reminders_id ON reminders (id);
+        CREATE INDEX IF NOT EXISTS idx_reminders_user_active ON reminders (user_id, active);
+        CREATE INDEX IF NOT EXISTS idx_reminders_next_fire ON reminders (next_fire_at);
+        CREATE TABLE IF NOT EXISTS users (
+            user_id TEXT PRIMARY KEY,
+            data TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value INTEGER
+        );
+        CREATE TABLE IF NOT EXISTS archive (
+            pk INTEGER PRIMARY KEY AUTOINCREMENT,
+            id INTEGER NOT NULL,
+            user_id INTEGER,
+            reason TEXT NOT NULL,
+            archived_at REAL NOT NULL,
+            data TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_archive_user ON archive (user_id, archived_at);
+    """
+
+    def __init__(self, path=SQLITE_PATH):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript(self.SCHEMA)
+
+    def load(self):
+        users = {user_id: json.loads(data) for user_id, data in self.conn.execute('SELECT user_id, data FROM users')}
+        # Напоминания читаются по курсору: в памяти одновременно только текущая строка
+        return self.iter_reminders(), users
+
+    def get_duplicate_reminders(self):
+        """Напоминания, id которых уже занят более ранней записью (старые версии выдавали id повторно)"""
+        rows = self.conn.execute('SELECT data FROM reminders r WHERE EXISTS '
+                                 '(SELECT 1 FROM reminders o WHERE o.id = r.id AND o.pk < r.pk) ORDER BY pk')
+        return [_decode(data) for (data,) in rows]
+
+    def count_reminders(self, user_id=None):
+        if user_id is None:
+            return self.conn.execute('SELECT COUNT(*) FROM reminders').fetchone()[0]
+        return self.conn.execute('SELECT COUNT(*) FROM reminders WHERE user_id = ?', (user_id,)).fetchone()[0]
+
+    def is_empty(self):
+        row = self.conn.execute('SELECT (SELECT COUNT(*) FROM reminders) + (SELECT COUNT(*) FROM users)').fetchone()
+        return row[0] == 0
+
+    def save_reminder(self, reminder):
+        with self.conn:
+            self._upsert_reminder(reminder)
+
+    def delete_reminder(self, reminder):
+        with self.conn:
+            self.conn.execute('DELETE FROM reminders WHERE user_id = ? AND id = ?',
+                              (reminder.user_id, reminder.id))
+
+    def save_user(self, user_id, user):
+        with self.conn:
+            self._upsert_user(user_id, user)
+
+    def save_reminders(self, reminders, next_id=None):
+        with self.conn:
+            for reminder in reminders:
+                self._upsert_reminder(reminder)
+            if next_id is not None:
+                self._upsert_sequence(next_id)
+
+    def get_user_reminders(self, user_id):
+        rows = self.conn.execute('SELECT data FROM reminders WHERE user_id = ? AND active = 1 ORDER BY pk',
+                                 (user_id,))
+        return [_decode(data) for (data,) in rows]
+
+    def iter_reminders(self, user_id=None, active=None):
+        # Отдельный курсор читает строки по мере перебора, не загружая всю выборку
+        conditions, params = [], []
+        if user_id is not None:
+            conditions.append('user_id = ?')
+            params.append(user_id)
+        if active is not None:
+            conditions.append('active = ?')
+            params.append(int(active))
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ''
+        rows = self.conn.execute(f'SELECT data FROM reminders{where} ORDER BY pk', params)
+        for (data,) in rows:
+            yield _decode(data)
+
+    def load_sequence(self):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = 'next_id'").fetchone()
+        return row[0] if row else 0
+
+    def save_sequence(self, next_id):
+        with self.conn:
+            self._upsert_sequence(next_id)
+
+    def archive_reminders(self, entries, archived_at):
+        size = 0
+        # Перенос одной транзакцией: запись либо в архиве, либо ещё в рабочей таблице
+        with self.conn:
+            for reminder, reason in entries:
+                data = json.dumps(archive_record(reminder, reason, archived_at), ensure_ascii=False)
+                size += len(data.encode('utf-8'))
+                self.conn.execute('INSERT INTO archive (id, user_id, reason, archived_at, data) '
+                                  'VALUES (?, ?, ?, ?, ?)', (reminder.id, reminder.user_id, reason, archived_at, data))
+                self.conn.execute('DELETE FROM reminders WHERE user_id = ? AND id = ?', (reminder.user_id, reminder.id))
+        return size
+
+    def iter_archive(self, user_id=None):
+        if user_id is None:
+            rows = self.conn.execute('SELECT data FROM archive ORDER BY pk')
+        else:
+            rows = self.conn.execute('SELECT data FROM archive WHERE user_id = ? ORDER BY archived_at, pk', (user_id,))
+        for (data,) in rows:
+            yield json.loads(data)
+
+    async def recent_archive(self, user_id, limit):
+        # Выборка по индексу idx_archive_user - быстрая, поток не нужен
+        rows = self.conn.execute('SELECT data FROM archive WHERE user_id = ? ORDER BY archived_at DESC, pk DESC '
+                                 'LIMIT ?', (user_id, limit))
+        return [json.loads(data) for (data,) in rows]
+
+    def get_user_reminders_page(self, user_id, offset, limit):
+        rows = self.conn.execute(f'SELECT data FROM reminders WHERE user_id = ? AND {_LISTED} ORDER BY pk '
+                                 'LIMIT ? OFFSET ?', (user_id, limit, offset))
+        page = [_decode(data) for (data,) in rows]
+        total = self.conn.execute(f'SELECT COUNT(*) FROM reminders WHERE user_id = ? AND {_LISTED}',
+                                  (user_id,)).fetchone()[0]
+        return page, total
+
+    def get_reminder(self, reminder_id, user_id):
+        # Поиск по (user_id, id) идёт по уникальному индексу, а не перебором таблицы
+        row = self.conn.execute('SELECT data FROM reminders WHERE user_id = ? AND id = ?',
+                                (user_id, reminder_id)).fetchone()
+        return _decode(row[0]) if row else None
+
+    def save_fired(self, reminder, expected_fire_at):
+        """Сохраняет срабатывание, если строку не меняли после выборки (next_fire_at прежний).
+
+        Возвращает False, если напоминание за это время удалили, приостановили или перенесли:
+        тогда в хранилище уже более новая версия, и перезаписывать её нельзя.
+        """
+        return self.save_schedules([(reminder, expected_fire_at)]) == 1
+
+    def save_schedules(self, entries):
+        """save_fired для пачки [(напоминание, прежний next_fire_at)] одной транзакцией.
+
+        Возвращает, сколько строк сохранено.
+        """
+        # IS, а не =: у записей из старых файлов next_fire_at ещё NULL
+        with self.conn:
+            cursor = self.conn.executemany(
+                'UPDATE reminders SET active = ?, next_fire_at = ?, data = ? '
+                'WHERE user_id = ? AND id = ? AND next_fire_at IS ?',
+                [(int(reminder.active), reminder.next_fire_at, json.dumps(reminder.to_dict(), ensure_ascii=False),
+                  reminder.user_id, reminder.id, expected_fire_at) for reminder, expected_fire_at in entries])
+        return cursor.rowcount
+
+    def get_due_reminders(self, now, shard_count, shards, limit):
+        """Наступившие напоминания указанных шардов (по индексу next_fire_at)"""
+        placeholders = ', '.join('?' * len(shards))
+        # Шард - user_id % shard_count: напоминания одного пользователя всегда в одном шарде
+        rows = self.conn.execute(
+            f'SELECT data FROM reminders WHERE next_fire_at <= ? AND active = 1 '
+            f'AND user_id % ? IN ({placeholders}) ORDER BY next_fire_at LIMIT ?',
+            (now, shard_count, *sorted(shards), limit))
+        return [_decode(data) for (data,) in rows]
+
+    def import_data(self, reminders, users):
+        """Импортирует все данные одной транзакцией"""
+        with self.conn:
+            for reminder in reminders:
+                self._upsert_reminder(reminder)
+            for user_id, user in users.items():
+                self._upsert_user(user_id, user)
+
+    def close(self):
+        self.conn.close()
+
+    def _upsert_reminder(self, reminder):
+        self.conn.execute(
+            'INSERT INTO reminders (id, user_id, active, next_fire_at, data) VALUES (?, ?, ?, ?, ?) '
+            'ON CONFLICT (user_id, id) DO UPDATE SET active = excluded.active, '
+            'next_fire_at = excluded.next_fire_at, data = excluded.data',
+            (reminder.id, reminder.user_id, int(reminder.active),
+             reminder.next_fire_at, json.dumps(reminder.to_dict(), ensure_ascii=False)))
+
+    def _upsert_sequence(self, next_id):
+        self.conn.execute("INSERT INTO meta (key, value) VALUES ('next_id', ?) "
+                          "ON CONFLICT (key) DO UPDATE SET value = excluded.value", (next_id,))
+
+    def _upsert_user(self, user_id, user):
+        self.conn.execute(
+            'INSERT INTO users (user_id, data) VALUES (?, ?) '
+            'ON CONFLICT (user_id) DO UPDATE SET data = excluded.data',
+            (str(user_id), json.dumps(user, ensure_ascii=False)))
+
+
+def _decode(data):
+    return Reminder.from_dict(json.loads(data))
+
+
+def _atomic_write(path, payload):
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-', suffix='.json')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def _write_snapshot(path, data):
+    # Записи превращаются в словари по одной прямо во время сериализации
+    _atomic_write(path, json.dumps(data, ensure_ascii=False, default=Reminder.to_dict))
+
+
+def _append(path, payload):
+    """Дописывает строки в журнал и дожидается их записи на диск; возвращает число байт"""
+    data = payload.encode('utf-8')
+    with open(path, 'ab') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    return len(data)
+
+
+def _truncate(path):
+    with open(path, 'wb') as f:
+        os.fsync(f.fileno())
+
+
+def _reminder_hook(data):
+    return Reminder.from_dict(data) if 'datetime' in data and 'text' in data else data
+
+
+def _read_json(path, default, object_hook=None):
+    """Содержимое JSON-файла или default, если файла нет.
+
+    Повреждённый файл не подменяется пустыми данными (иначе следующая запись
+    затёрла бы его): поднимается CorruptedStorageError.
+    """
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f, object_hook=object_hook)
+    except FileNotFoundError:
+        return default
+    except json.JSONDecodeError as e:
+        raise CorruptedStorageError(f"{path} is corrupted ({e}); restore it from a backup or move it away") from e
+
+
+def migrate_json_to_sqlite(storage, reminders_file=REMINDERS_FILE, users_file=USERS_FILE):
+    """Однократно переносит reminders.json/users.json (вместе с журналом) в пустую SQLite-базу"""
+    if not storage.is_empty():
+        return False
+    source = JsonStorage(reminders_file, users_file)
+    reminders, users = source.load()
+    if not reminders and not users:
+        return False
+    storage.import_data(reminders, users)
+    if source.load_sequence():
+        storage.save_sequence(source.load_sequence())
+    logger.info("Migrated %s reminders and %s users from JSON to %s", len(reminders), len(users), storage.path)
+    return True
+
+
+def create_storage(backend=None):
+    """Создаёт хранилище по переменной окружения STORAGE_BACKEND (json | sqlite)"""
+    backend = backend or STORAGE_BACKEND
+    if backend == 'sqlite':
+        storage = SqliteStorage()
+        migrate_json_to_sqlite(storage)
+        return storage
+    if backend == 'json':
+        return JsonStorage()
+    raise ValueError(f"Unknown storage backend: {backend}")
+
+
+if __name__ == "__main__":
+    # python storage.py migrate [reminders.json] [users.json] [napominalkin.db]
+    if len(sys.argv) < 2 or sys.argv[1] != 'migrate':
+        print("Usage: python storage.py migrate [reminders.json] [users.json] [napominalkin.db]")
+        sys.exit(1)
+    logging.basicConfig(level=logging.INFO)
+    args = sys.argv[2:] + [REMINDERS_FILE, USERS_FILE, SQLITE_PATH][len(sys.argv) - 2:]
+    sqlite_storage = SqliteStorage(args[2])
+    if not migrate_json_to_sqlite(sqlite_storage, args[0], args[1]):
+        print("Nothing to migrate: database is not empty or JSON files are missing")
+    sqlite_storage.close()
@@ -3,8 +3,25 @@
 Тестовый скрипт для проверки функциональности бота напоминаний
 """
 
+import asyncio
 import json
 import datetime
+import os
+import sqlite3
+import tempfile
+import time
+import zoneinfo
+
+from aiogram.exceptions import TelegramForbiddenError, TelegramNetworkError, TelegramRetryAfter
+from aiogram.methods import SendMessage
+
+from delivery import DeliveryQueue, TokenBucket
+from models import Reminder
+from recurrence import advance, next_occurrence, schedule_time, snooze_time
+from rendering import render_archive_entry, render_card, render_confirmation, render_notification, repeat_text
+from reminder_scheduler import ReminderScheduler
+from sharding import LeaseStore, ShardCoordinator
+from storage import CorruptedStorageError, JsonStorage, SqliteStorage, migrate_json_to_sqlite
 
 # Тест базы данных
 def test_database():
@@ -106,6 +123,1053 @@ def test_notification_message():
     print(message)
     print("✅ Форматирование сообщений работает корректно!")
 
+def test_scheduler_queue():
+    print("\n🧪 Тестирование очереди планировщика...")
+    
+    scheduler = ReminderScheduler()
+    scheduler.schedule(1, 300, {'id': 1})
+    scheduler.schedule(2, 100, {'id': 2})
+    scheduler.schedule(3, 200, {'id': 3})
+    
+    # Перепланирование и удаление не должны оставлять дублей
+    scheduler.schedule(3, 400, {'id': 3})
+    scheduler.unschedule(1)
+    
+    assert scheduler.next_fire_at() == 100
+    assert [key for key, _, _ in scheduler.pop_due(350)] == [2]
+    assert scheduler.next_fire_at() == 400
+    assert len(scheduler) == 1
+    print("✅ Очередь возвращает только наступившие напоминания!")
+
+def test_recurrence():
+    print("\n🧪 Тестирование расчёта повторений...")
+    
+    # 2025-09-01 - понедельник
+    anchor = datetime.datetime(2025, 9, 1, 9, 30)
+    moscow = zoneinfo.ZoneInfo('Europe/Moscow')
+    ts = lambda *args, tz=moscow: int(datetime.datetime(*args, tzinfo=tz).timestamp())
+    
+    once = {'datetime': anchor.isoformat(), 'repeat': 'none', 'timezone': 'Europe/Moscow'}
+    assert next_occurrence(once) == ts(2025, 9, 1, 9, 30)
+    assert next_occurrence(once, ts(2025, 9, 1, 9, 30)) is None
+    
+    daily = {'datetime': anchor.isoformat(), 'repeat': 'daily', 'timezone': 'Europe/Moscow'}
+    assert next_occurrence(daily, ts(2025, 9, 3, 9, 30)) == ts(2025, 9, 4, 9, 30)
+    assert next_occurrence(daily, ts(2025, 9, 3, 8, 0)) == ts(2025, 9, 3, 9, 30)
+    
+    weekly = {'datetime': anchor.isoformat(), 'repeat': 'weekly', 'timezone': 'Europe/Moscow'}
+    assert next_occurrence(weekly, ts(2025, 9, 2)) == ts(2025, 9, 8, 9, 30)
+    
+    # Web App нумерует дни с воскресенья: 0=Вс, 3=Ср, 5=Пт
+    custom = {'datetime': anchor.isoformat(), 'repeat': 'custom', 'days': [3, 5], 'timezone': 'Europe/Moscow'}
+    assert next_occurrence(custom) == ts(2025, 9, 3, 9, 30)
+    assert next_occurrence(custom, ts(2025, 9, 3, 9, 30)) == ts(2025, 9, 5, 9, 30)
+    assert next_occurrence(custom, ts(2025, 9, 5, 10, 0)) == ts(2025, 9, 10, 9, 30)
+    
+    # Бот был выключен с 1 по 4 сентября
+    now = ts(2025, 9, 4, 12, 0)
+    daily['last_fired_at'] = ts(2025, 9, 1, 9, 30)
+    assert schedule_time(daily, now, policy='skip') == ts(2025, 9, 5, 9, 30)
+    assert schedule_time(daily, now, policy='once', window=7 * 86400) == ts(2025, 9, 2, 9, 30)
+    assert advance(daily, ts(2025, 9, 2, 9, 30), now, policy='once') == ts(2025, 9, 5, 9, 30)
+    assert advance(daily, ts(2025, 9, 2, 9, 30), now, policy='all') == ts(2025, 9, 4, 9, 30)
+    
+    # Время срабатывания хранится в UTC, а повторение идёт по местному времени пользователя:
+    # 26 октября 2025 Берлин переходит на зимнее время, между срабатываниями 25 часов
+    berlin = zoneinfo.ZoneInfo('Europe/Berlin')
+    daily_berlin = {'datetime': '2025-10-25T09:00', 'repeat': 'daily', 'timezone': 'Europe/Berlin'}
+    first = next_occurrence(daily_berlin)
+    assert first == ts(2025, 10, 25, 9, 0, tz=berlin)
+    assert next_occurrence(daily_berlin, first) - first == 25 * 3600
+    
+    # Старые записи со смещением переводятся в пояс пользователя
+    legacy = {'datetime': '2025-09-01T06:30:00+00:00', 'repeat': 'daily', 'timezone': 'Europe/Moscow'}
+    assert next_occurrence(legacy, ts(2025, 9, 2, 0, 0)) == ts(2025, 9, 2, 9, 30)
+    print("✅ Повторения и догоняющая отправка считаются корректно!")
+
+def test_sqlite_storage():
+    print("\n🧪 Тестирование SQLite-хранилища...")
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        reminders_file = os.path.join(tmp, 'reminders.json')
+        users_file = os.path.join(tmp, 'users.json')
+        with open(reminders_file, 'w', encoding='utf-8') as f:
+            json.dump([
+                {'id': 1, 'user_id': 1, 'text': 'Купить молоко', 'datetime': '2024-01-01T10:00:00', 'active': True},
+                {'id': 2, 'user_id': 2, 'text': 'Позвонить маме', 'datetime': '2024-01-01T12:00:00', 'active': True},
+            ], f)
+        with open(users_file, 'w', encoding='utf-8') as f:
+            json.dump({'1': {'first_name': 'Иван'}}, f)
+        
+        storage = SqliteStorage(os.path.join(tmp, 'napominalkin.db'))
+        assert migrate_json_to_sqlite(storage, reminders_file, users_file)
+        # Повторная миграция не выполняется
+        assert not migrate_json_to_sqlite(storage, reminders_file, users_file)
+        
+        reminder = storage.get_user_reminders(1)[0]
+        assert reminder.text == 'Купить молоко'
+        reminder.active = False
+        storage.save_reminder(reminder)
+        assert storage.get_user_reminders(1) == []
+        assert storage.get_reminder(1, 1).active is False and storage.get_reminder(1, 2) is None
+        
+        storage.delete_reminder(Reminder(id=2, user_id=2))
+        reminders, users = storage.load()
+        assert [r['id'] for r in reminders] == [1]
+        assert users['1']['first_name'] == 'Иван'
+        storage.close()
+    print("✅ SQLite-хранилище и миграция работают!")
+
+def test_json_write_coalescing():
+    print("\n🧪 Тестирование отложенной записи JSON...")
+    
+    async def scenario(storage):
+        reminders, _ = storage.load()
+        flusher = asyncio.create_task(storage.run_flusher(interval=0.05))
+        await asyncio.sleep(0)
+        for i in range(100):
+            reminders.append(Reminder.from_dict({'id': i + 1, 'user_id': 1, 'text': f'Напоминание {i}',
+                                                 'datetime': '2030-01-01T09:00:00'}))
+            storage.save_reminder(reminders[-1])
+        # До сброса на диск журнал не создаётся
+        assert not os.path.exists(storage.journal_file)
+        # Ждём фоновый сброс с запасом: пауза сборщика мусора может его задержать
+        for _ in range(100):
+            await asyncio.sleep(0.02)
+            if os.path.exists(storage.journal_file):
+                break
+        with open(storage.journal_file, encoding='utf-8') as f:
+            entries = [json.loads(line) for line in f]
+        assert [e['op'] for e in entries] == ['snapshot'] + ['put'] * 100
+        storage.stop_flusher()
+        await flusher
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        storage = JsonStorage(os.path.join(tmp, 'reminders.json'), os.path.join(tmp, 'users.json'))
+        asyncio.run(scenario(storage))
+        # Снимок пишется только при сворачивании журнала
+        assert os.listdir(tmp) == ['reminders.json.journal']
+        assert len(JsonStorage(storage.reminders_file, storage.users_file).load()[0]) == 100
+        storage.close()
+        assert sorted(os.listdir(tmp)) == ['reminders.json', 'reminders.json.journal', 'users.json']
+        assert os.path.getsize(storage.journal_file) == 0
+        with open(storage.reminders_file, encoding='utf-8') as f:
+            assert len(json.load(f)['reminders']) == 100
+    print("✅ 100 изменений дописаны в журнал одной записью!")
+
+def test_journal_recovery():
+    print("\n🧪 Тестирование журнала и восстановления после сбоя...")
+    
+    def reminder(reminder_id, text='Тест'):
+        return Reminder.from_dict({'id': reminder_id, 'user_id': 1, 'text': text, 'datetime': '2030-01-01T09:00:00'})
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = (os.path.join(tmp, 'reminders.json'), os.path.join(tmp, 'users.json'))
+        storage = JsonStorage(*paths, compact_bytes=10 ** 6)
+        storage.load()
+        first, second = reminder(1), reminder(2)
+        storage.save_reminders([first, second], next_id=3)
+        storage.save_user('1', {'first_name': 'Иван'})
+        first.text = 'Изменено'
+        storage.save_reminder(first)
+        storage.delete_reminder(second)
+        # Процесс убит посреди дозаписи: последняя строка журнала оборвана
+        with open(storage.journal_file, 'a', encoding='utf-8') as f:
+            f.write('{"op": "put", "remin')
+        
+        storage = JsonStorage(*paths)
+        reminders, users = storage.load()
+        assert [(r.id, r.text) for r in reminders] == [(1, 'Изменено')]
+        assert users == {'1': {'first_name': 'Иван'}} and storage.load_sequence() == 3
+        # Первая же запись сворачивает журнал с обрывком в снимок
+        storage.save_reminder(reminder(3))
+        assert os.path.getsize(storage.journal_file) == 0
+        assert [r.id for r in JsonStorage(*paths).load()[0]] == [1, 3]
+        
+        # Остановка между записью снимка и очисткой журнала: старый журнал не применяется
+        storage.save_reminder(reminder(4, 'Старое'))
+        with open(storage.journal_file, encoding='utf-8') as f:
+            stale = f.read()
+        storage.compact()
+        with open(storage.journal_file, 'w', encoding='utf-8') as f:
+            f.write(stale.replace('Старое', 'Устаревшее'))
+        assert [r.text for r in JsonStorage(*paths).load()[0]] == ['Изменено', 'Тест', 'Старое']
+        
+        # Повреждённый снимок не подменяется пустыми данными
+        with open(paths[0], 'w', encoding='utf-8') as f:
+            f.write('{"reminders": [')
+        try:
+            JsonStorage(*paths).load()
+            assert False, "повреждённый снимок загружен"
+        except CorruptedStorageError:
+            pass
+    print("✅ Журнал переживает обрыв записи, повреждённый снимок не затирается!")
+
+def test_flusher_shutdown():
+    print("\n🧪 Тестирование остановки фоновой записи посреди снимка...")
+    import storage as storage_module
+    atomic_write = storage_module._atomic_write
+    
+    def slow_write(path, payload):
+        time.sleep(0.2)
+        atomic_write(path, payload)
+    
+    def reminder(reminder_id):
+        return Reminder.from_dict({'id': reminder_id, 'user_id': 1, 'text': 'Тест', 'datetime': '2030-01-01T09:00:00'})
+    
+    async def scenario(storage, stop):
+        storage.load()
+        flusher = asyncio.create_task(storage.run_flusher(interval=0.01))
+        storage.save_reminder(reminder(1))
+        # Ждём, пока поток начнёт писать снимок, и меняем данные посреди записи
+        await asyncio.sleep(0.1)
+        storage.save_reminder(reminder(2))
+        stop(storage, flusher)
+        await asyncio.gather(flusher, return_exceptions=True)
+        storage.close()
+    
+    storage_module._atomic_write = slow_write
+    try:
+        # Штатная остановка и отмена задачи (например, при аварийном завершении цикла)
+        for stop in (lambda storage, task: storage.stop_flusher(), lambda storage, task: task.cancel()):
+            with tempfile.TemporaryDirectory() as tmp:
+                paths = (os.path.join(tmp, 'reminders.json'), os.path.join(tmp, 'users.json'))
+                storage = JsonStorage(*paths, compact_bytes=0)
+                asyncio.run(scenario(storage, stop))
+                assert [r.id for r in JsonStorage(*paths).load()[0]] == [1, 2]
+    finally:
+        storage_module._atomic_write = atomic_write
+    print("✅ Остановка и отмена дожидаются записи снимка, данные не теряются!")
+
+def test_downtime_report():
+    print("\n🧪 Тестирование отчёта о пропущенных напоминаниях...")
+    with tempfile.TemporaryDirectory() as tmp:
+        db = load_database(tmp)
+        from main import report_missed_reminders
+        now = time.time()
+        past = datetime.datetime.now() - datetime.timedelta(hours=2)
+        daily = db.add_reminder({'text': 'Каждый день', 'datetime': past.isoformat(), 'repeat': 'daily', 'user_id': 1})
+        once = db.add_reminder({'text': 'Давно', 'datetime': (past - datetime.timedelta(days=2)).isoformat(),
+                                'repeat': 'none', 'user_id': 1})
+        db.add_reminder({'text': 'Завтра', 'datetime': (past + datetime.timedelta(days=1)).isoformat(),
+                         'repeat': 'none', 'user_id': 1})
+        # add_reminder уже догоняет пропуски - имитируем состояние, сохранённое до простоя
+        daily.next_fire_at = once.next_fire_at = now - 7200
+        db.storage.save_reminders([daily, once])
+        db.storage.close()
+        
+        db = load_database(tmp)
+        assert sorted(r.id for r, _ in db.missed) == [daily.id, once.id]
+        path = os.path.join(tmp, 'downtime_report.json')
+        report = report_missed_reminders(db.missed, path=path)
+        with open(path, encoding='utf-8') as f:
+            assert json.load(f) == report
+        actions = {entry['text']: entry['action'] for entry in report['missed']}
+        # Политика по умолчанию (once): ежедневное догоняется, старое разовое вне окна пропускается
+        assert actions == {'Каждый день': 'catch_up', 'Давно': 'skip'}
+        assert report_missed_reminders([], path=path) is None
+    print("✅ Пропущенные во время простоя напоминания попадают в отчёт!")
+
+def load_database(tmp, **kwargs):
+    # main.py создаёт бота при импорте, поэтому подставляем фиктивный токен
+    os.environ.setdefault('BOT_TOKEN', '123456:TEST')
+    from main import Database
+    
+    storage = JsonStorage(os.path.join(tmp, 'reminders.json'), os.path.join(tmp, 'users.json'))
+    return Database(storage=storage, **kwargs)
+
+def test_database_indexes():
+    print("\n🧪 Тестирование индексов базы данных...")
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        db = load_database(tmp)
+        when = (datetime.datetime.now() + datetime.timedelta(days=1)).isoformat()
+        for user_id in (1, 1, 2):
+            db.add_reminder({'text': 'Тест', 'datetime': when, 'repeat': 'none', 'days': None, 'user_id': user_id})
+        
+        first, second = db.get_user_reminders(1)
+        assert db.get_reminder(second['id'], 1) is second
+        assert db.get_reminder(second['id'], 2) is None
+        
+        assert db.toggle_reminder(first['id'], 1) is False
+        assert db.get_user_reminders(1) == [second]
+        
+        # Чужое напоминание удалить нельзя
+        db.delete_reminder(second['id'], 2)
+        assert db.get_reminder(second['id'], 1) is second
+        db.delete_reminder(second['id'], 1)
+        assert db.get_user_reminders(1) == []
+        
+        # После перезагрузки индексы восстанавливаются из файла
+        db.load_data()
+        assert db.get_reminder(first['id'], 1)['active'] is False
+        assert len(db.get_user_reminders(2)) == 1
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        scheduler = ReminderScheduler()
+        db = load_database(tmp, scheduler=scheduler)
+        # Ежедневное, поставленное на паузу и возобновлённое после своего времени:
+        # пропущенное за паузу не отправляется, следующее - завтра
+        when = (datetime.datetime.now() - datetime.timedelta(minutes=5)).isoformat()
+        reminder = db.add_reminder({'text': 'Зарядка', 'datetime': when, 'repeat': 'daily', 'user_id': 1})
+        assert db.toggle_reminder(reminder.id, 1) is False
+        assert db.toggle_reminder(reminder.id, 1) is True
+        now = time.time()
+        assert scheduler.pop_due(now) == []
+        assert now < reminder.next_fire_at <= now + 86400
+        # Смена пояса тоже не досылает прошедшее
+        db.set_user_timezone(1, 'Asia/Tokyo')
+        assert scheduler.pop_due(time.time()) == []
+    print("✅ Индексы по пользователю и id согласованы!")
+
+def test_reminder_ids():
+    print("\n🧪 Тестирование выдачи id напоминаний...")
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        # Файл старого формата с повторяющимися id
+        when = (datetime.datetime.now() + datetime.timedelta(days=1)).isoformat()
+        legacy = [{'id': 1, 'user_id': user_id, 'text': 'Тест', 'datetime': when, 'repeat': 'none', 'active': True}
+                  for user_id in (1, 2)]
+        with open(os.path.join(tmp, 'reminders.json'), 'w', encoding='utf-8') as f:
+            json.dump(legacy, f)
+        
+        db = load_database(tmp)
+        ids = sorted(r['id'] for r in db.reminders)
+        assert ids == [1, 2]
+        
+        reminder = db.add_reminder({'text': 'Тест', 'datetime': when, 'repeat': 'none', 'days': None, 'user_id': 1})
+        assert reminder['id'] == 3
+        db.delete_reminder(3, 1)
+        
+        # Удалённый id не выдаётся повторно, в том числе после перезапуска
+        db = load_database(tmp)
+        reminder = db.add_reminder({'text': 'Тест', 'datetime': when, 'repeat': 'none', 'days': None, 'user_id': 1})
+        assert reminder['id'] == 4
+    print("✅ Id уникальны и не переиспользуются!")
+
+class FakeBot:
+    """Имитация bot.send_message: запоминает отправки и выдаёт заданные ошибки"""
+    
+    def __init__(self, errors=None):
+        self.sent = []
+        self.errors = errors or {}
+    
+    async def send_message(self, chat_id, text, **kwargs):
+        errors = self.errors.get(chat_id)
+        if errors:
+            raise errors.pop(0)
+        self.sent.append((chat_id, asyncio.get_running_loop().time()))
+
+def test_token_bucket():
+    print("\n🧪 Тестирование ведра токенов...")
+    
+    clock = [0.0]
+    bucket = TokenBucket(rate=2, capacity=2, clock=lambda: clock[0])
+    bucket.consume()
+    bucket.consume()
+    assert bucket.delay() == 0.5
+    clock[0] = 0.5
+    assert bucket.delay() == 0
+    print("✅ Ведро токенов пополняется с заданной скоростью!")
+
+def test_delivery_queue():
+    print("\n🧪 Тестирование очереди отправки...")
+    
+    method = SendMessage(chat_id=1, text='')
+    bot = FakeBot(errors={
+        1: [TelegramRetryAfter(method=method, message='Too Many Requests', retry_after=0.1)],
+        2: [TelegramNetworkError(method=method, message='timeout')],
+        3: [TelegramForbiddenError(method=method, message='bot was blocked by the user')],
+        5: [RuntimeError('unexpected')],
+    })
+    
+    async def scenario():
+        queue = DeliveryQueue(bot.send_message, workers=4, global_rate=1000, chat_rate=20, chat_burst=1,
+                              retry_backoff=0.05, dead_letter_file=None)
+        for chat_id in (1, 2, 3, 5):
+            queue.submit(chat_id, 'Напоминание')
+        for _ in range(5):
+            queue.submit(4, 'Напоминание')
+        await queue.stop()
+        return queue
+    
+    queue = asyncio.run(scenario())
+    sent_chats = [chat_id for chat_id, _ in bot.sent]
+    assert sorted(sent_chats) == [1, 2, 4, 4, 4, 4, 4]
+    assert queue.stats['rate_limited'] == 1 and queue.stats['retried'] == 1
+    # Непредвиденная ошибка тоже уходит в dead-letter, а обработчики продолжают работу
+    assert sorted(record['chat_id'] for record in queue.dead_letters) == [3, 5]
+    
+    # Сообщения в один чат идут не чаще chat_rate в секунду
+    times = [t for chat_id, t in bot.sent if chat_id == 4]
+    assert all(b - a >= 0.04 for a, b in zip(times, times[1:]))
+    
+    async def restart_scenario():
+        queue = DeliveryQueue(bot.send_message, workers=2, global_rate=1000, chat_rate=1, chat_burst=1,
+                              dead_letter_file=None)
+        for _ in range(3):
+            queue.submit(6, 'Напоминание')
+        # Два сообщения ждут лимита чата дольше таймаута остановки
+        await queue.stop(timeout=0.1)
+        assert len(queue) == 0 and len(queue.dead_letters) == 2
+        # После перезапуска join() ждёт только новых сообщений
+        queue.start()
+        queue.submit(7, 'Напоминание')
+        await asyncio.wait_for(queue.join(), 1)
+        await queue.stop()
+    
+    asyncio.run(restart_scenario())
+    print("✅ Очередь соблюдает лимиты, повторяет временные ошибки и ведёт dead-letter!")
+
+def test_synthetic_reminders():
+    print("\n🧪 Тестирование генератора синтетических напоминаний...")
+    
+    from bench_scheduler import generate_reminders
+    
+    reminders = list(generate_reminders(500))
+    assert {r['repeat'] for r in reminders} == {'none', 'daily', 'weekly', 'custom'}
+    for reminder in reminders:
+        assert set(reminder) == {'text', 'datetime', 'repeat', 'days', 'user_id', 'id', 'created_at', 'active'}
+        assert next_occurrence(reminder) is not None
+    print("✅ Синтетические напоминания совпадают по формату с Web App!")
+
+def test_webhook_app():
+    print("\n🧪 Тестирование приёма обновлений через вебхук...")
+    
+    os.environ.setdefault('BOT_TOKEN', '123456:TEST')
+    from aiohttp.test_utils import TestClient, TestServer
+    from main import create_webhook_app
+    
+    update = {
+        'update_id': 1,
+        'message': {
+            'message_id': 1,
+            'date': 0,
+            'chat': {'id': 1, 'type': 'private'},
+            'from': {'id': 1, 'is_bot': False, 'first_name': 'Иван'},
+            'text': 'Привет',
+        },
+    }
+    
+    async def scenario():
+        client = TestClient(TestServer(create_webhook_app(secret_token='test-secret')))
+        await client.start_server()
+        try:
+            response = await client.get('/health')
+            assert response.status == 200
+            assert (await response.json())['status'] == 'ok'
+            
+            response = await client.post('/webhook', json=update)
+            assert response.status == 401
+            
+            response = await client.post('/webhook', json=update,
+                                         headers={'X-Telegram-Bot-Api-Secret-Token': 'test-secret'})
+            assert response.status == 200
+        finally:
+            await client.close()
+    
+    asyncio.run(scenario())
+    
+    # Без секрета вебхук не запускается
+    import main
+    base_url, main.WEBHOOK_BASE_URL = main.WEBHOOK_BASE_URL, 'https://example.com'
+    secret, main.WEBHOOK_SECRET = main.WEBHOOK_SECRET, None
+    try:
+        asyncio.run(main.run_webhook())
+        assert False, "вебхук запущен без секрета"
+    except RuntimeError:
+        pass
+    finally:
+        main.WEBHOOK_BASE_URL, main.WEBHOOK_SECRET = base_url, secret
+    print("✅ Вебхук проверяет секрет и принимает обновления!")
+
+def test_shard_leases():
+    print("\n🧪 Тестирование аренды шардов...")
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'leases.db')
+        first, second = LeaseStore(path), LeaseStore(path)
+        
+        # Первый воркер один - забирает все шарды
+        assert first.acquire('worker-1', 4, ttl=30, now=1000) == {0, 1, 2, 3}
+        # Второй воркер получает свободные шарды после того, как первый отдаст лишние
+        assert second.acquire('worker-2', 4, ttl=30, now=1001) == set()
+        assert first.acquire('worker-1', 4, ttl=30, now=1010) == {0, 1}
+        assert second.acquire('worker-2', 4, ttl=30, now=1011) == {2, 3}
+        
+        # Первый воркер упал: после истечения аренды его шарды переходят второму
+        assert second.acquire('worker-2', 4, ttl=30, now=1050) == {0, 1, 2, 3}
+        
+        # Одно срабатывание отправляется только один раз
+        coordinator = ShardCoordinator(first, owner='worker-1', shard_count=4)
+        reminder = {'id': 7, 'user_id': 5}
+        assert coordinator.claim_delivery(reminder, 1000.0)
+        assert not ShardCoordinator(second, owner='worker-2', shard_count=4).claim_delivery(reminder, 1000.0)
+        assert coordinator.claim_delivery(reminder, 87400.0)
+        first.close()
+        second.close()
+    print("✅ Шарды делятся между воркерами, аренда переходит при сбое!")
+
+def test_shared_database():
+    print("\n🧪 Тестирование общего хранилища шардированного режима...")
+    os.environ.setdefault('BOT_TOKEN', '123456:TEST')
+    from main import Database
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bot.db')
+        # Процесс с обработчиками и воркер работают с одним SQLite-файлом
+        bot_db = Database(storage=SqliteStorage(path), shared=True)
+        worker_db = Database(storage=SqliteStorage(path), shared=True)
+        when = (datetime.datetime.now() + datetime.timedelta(days=1)).isoformat()
+        reminders = [bot_db.add_reminder({'text': f'Дело {i}', 'datetime': when, 'repeat': 'daily', 'user_id': 1})
+                     for i in range(3)]
+        now = time.time()
+        for reminder in reminders:
+            reminder.next_fire_at = now - 10
+            bot_db.storage.save_reminder(reminder)
+        
+        due = worker_db.storage.get_due_reminders(now, 1, {0}, 10)
+        assert len(due) == 3
+        # Пока воркер отправляет, пользователь удаляет одно напоминание и ставит на паузу другое
+        bot_db.delete_reminder(reminders[0].id, 1)
+        bot_db.toggle_reminder(reminders[1].id, 1)
+        for reminder in due:
+            worker_db.mark_fired(reminder, reminder.next_fire_at, now)
+        
+        stored = {r.id: r for r in bot_db.storage.iter_reminders()}
+        assert reminders[0].id not in stored
+        assert stored[reminders[1].id].active is False and stored[reminders[1].id].next_fire_at is None
+        assert stored[reminders[2].id].next_fire_at > now
+        
+        # Смена пояса переводит и приостановленные напоминания
+        bot_db.set_user_timezone(1, 'Asia/Tokyo')
+        assert {r.timezone for r in bot_db.storage.iter_reminders(1)} == {'Asia/Tokyo'}
+        bot_db.storage.close()
+        worker_db.storage.close()
+        
+        # Записи из старого reminders.json без next_fire_at: время считается при загрузке и сохраняется
+        reminders_file = os.path.join(tmp, 'reminders.json')
+        users_file = os.path.join(tmp, 'users.json')
+        with open(reminders_file, 'w', encoding='utf-8') as f:
+            json.dump([{'id': 1, 'user_id': 1, 'text': 'Старое', 'datetime': when, 'active': True}], f)
+        with open(users_file, 'w', encoding='utf-8') as f:
+            json.dump({}, f)
+        path = os.path.join(tmp, 'legacy.db')
+        assert migrate_json_to_sqlite(SqliteStorage(path), reminders_file, users_file)
+        Database(storage=SqliteStorage(path), shared=True)
+        worker_storage = SqliteStorage(path)
+        due = worker_storage.get_due_reminders(time.time() + 2 * 86400, 1, {0}, 10)
+        assert [r.id for r in due] == [1] and due[0].next_fire_at is not None
+        worker_storage.close()
+    print("✅ Отправка не возвращает удалённые и приостановленные напоминания!")
+
+def test_scheduler_errors():
+    print("\n🧪 Тестирование устойчивости планировщика к ошибкам...")
+    os.environ.setdefault('BOT_TOKEN', '123456:TEST')
+    import main
+    
+    calls = []
+    
+    async def failing_check():
+        calls.append(time.time())
+        raise sqlite3.OperationalError('database is locked')
+    
+    class StubScheduler:
+        async def wait(self):
+            await asyncio.sleep(0)
+    
+    async def scenario():
+        task = asyncio.create_task(main.scheduler())
+        while len(calls) < 3 and not task.done():
+            await asyncio.sleep(0)
+        # Задача жива после нескольких ошибок подряд
+        assert not task.done()
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+    
+    check_reminders, reminder_scheduler = main.check_reminders, main.reminder_scheduler
+    main.check_reminders, main.reminder_scheduler = failing_check, StubScheduler()
+    try:
+        asyncio.run(scenario())
+    finally:
+        main.check_reminders, main.reminder_scheduler = check_reminders, reminder_scheduler
+    assert len(calls) == 3
+    print("✅ Ошибка прохода не останавливает планировщик!")
+
+def test_sqlite_database():
+    print("\n🧪 Тестирование базы без копии напоминаний в памяти (SQLite)...")
+    os.environ.setdefault('BOT_TOKEN', '123456:TEST')
+    import main
+    
+    class StubQueue:
+        def __init__(self):
+            self.sent = []
+            self.stats = {'sent': 0, 'failed': 0}
+        
+        def submit(self, chat_id, text, scheduled_at=None, **kwargs):
+            self.sent.append((chat_id, text))
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bot.db')
+        storage = SqliteStorage(path)
+        # Старые версии выдавали id повторно: у двух пользователей напоминание с id 1
+        when = (datetime.datetime.now() + datetime.timedelta(days=1)).isoformat()
+        storage.save_reminders([Reminder.from_dict({'id': 1, 'user_id': user_id, 'text': 'Старое', 'datetime': when})
+                                for user_id in (1, 2)], next_id=2)
+        
+        scheduler = ReminderScheduler()
+        db = main.Database(scheduler=scheduler, storage=storage)
+        assert not db.resident and db._by_id == {}
+        assert sorted((r.user_id, r.id) for r in db.reminders) == [(1, 1), (2, 2)]
+        
+        saved = main.db, main.reminder_scheduler, main.delivery_queue
+        main.db, main.reminder_scheduler, main.delivery_queue = db, scheduler, StubQueue()
+        try:
+            past = (datetime.datetime.now() - datetime.timedelta(seconds=30)).isoformat()
+            # Напоминание и счётчик id пишутся одной транзакцией, без отдельных save_sequence/save_reminder
+            storage.save_sequence = storage.save_reminder = None
+            reminder = db.add_reminder({'text': 'Позвонить', 'datetime': past, 'repeat': 'none', 'user_id': 1})
+            del storage.save_sequence, storage.save_reminder
+            assert storage.load_sequence() == reminder.id + 1
+            # В планировщике только user_id, само напоминание читается из хранилища
+            assert len(scheduler) == 3 and not any(isinstance(entry[3], Reminder) for entry in scheduler._heap)
+            asyncio.run(main.check_reminders())
+            assert main.delivery_queue.sent[0][0] == 1 and 'Позвонить' in main.delivery_queue.sent[0][1]
+            assert db.get_reminder(reminder.id, 1).active is False and len(scheduler) == 2
+            
+            db.snooze(db.get_reminder(reminder.id, 1), '10m')
+            scheduler.schedule(main.snooze_key(reminder.id), time.time() - 1, 1)
+            asyncio.run(main.check_reminders())
+            assert len(main.delivery_queue.sent) == 2
+            
+            assert db.toggle_reminder(1, 1) is False and len(scheduler) == 1
+            # Приостановленное остаётся в списке, отправленное разовое - нет
+            page, total = db.get_user_reminders_page(1, 0, 5)
+            assert total == 1 and [r.id for r in page] == [1] and page[0].active is False
+            db.delete_reminder(2, 2)
+            assert len(scheduler) == 0 and db.reminder_count() == 2
+        finally:
+            main.db, main.reminder_scheduler, main.delivery_queue = saved
+        
+        db.set_user_timezone(1, 'Asia/Tokyo')
+        assert {r.timezone for r in db.iter_reminders(1)} == {'Asia/Tokyo'}
+        storage.close()
+    print("✅ SQLite-база читает напоминания из хранилища, в памяти только очередь!")
+
+def test_reminders_page():
+    print("\n🧪 Тестирование постраничного списка...")
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        db = load_database(tmp)
+        import main
+        main.db, saved_db = db, main.db
+        try:
+            when = (datetime.datetime.now() + datetime.timedelta(days=1)).isoformat()
+            for i in range(7):
+                db.add_reminder({'text': f'Дело {i}', 'datetime': when, 'repeat': 'none', 'days': None, 'user_id': 1})
+            
+            page, total = db.get_user_reminders_page(1, 5, 5)
+            assert total == 7 and [r['text'] for r in page] == ['Дело 5', 'Дело 6']
+            
+            text, markup = main.render_reminders_page(1, 1)
+            assert 'стр. 2/2' in text and 'Дело 6' in text
+            callbacks = [button.callback_data for row in markup.inline_keyboard for button in row]
+            assert callbacks == ['toggle_6_1', 'delete_6_1', 'toggle_7_1', 'delete_7_1', 'page_0']
+            
+            # После удаления последних напоминаний показывается предыдущая страница
+            db.delete_reminder(6, 1)
+            db.delete_reminder(7, 1)
+            text, _ = main.render_reminders_page(1, 1)
+            assert 'стр. 1/1' in text
+            assert main.render_reminders_page(2, 0) == (None, None)
+            
+            # Приостановленное показывается с кнопкой возобновления, отправленное разовое скрывается
+            db.toggle_reminder(1, 1)
+            db.mark_fired(db.get_reminder(2, 1), time.time(), time.time())
+            text, markup = main.render_reminders_page(1, 0)
+            assert '(4)' in text and 'Дело 1' not in text
+            assert markup.inline_keyboard[0][0].text == '▶️ 1' and markup.inline_keyboard[1][0].text == '⏸️ 2'
+        finally:
+            main.db = saved_db
+    print("✅ Список напоминаний помещается в одно сообщение с навигацией!")
+
+def test_user_timezone():
+    print("\n🧪 Тестирование часового пояса пользователя...")
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        db = load_database(tmp)
+        day = datetime.date.today() + datetime.timedelta(days=2)
+        when = datetime.datetime.combine(day, datetime.time(9, 0))
+        reminder = db.add_reminder({'text': 'Зарядка', 'datetime': when.isoformat(), 'repeat': 'daily', 'days': None, 'user_id': 1})
+        assert reminder['timezone'] == db.get_user_timezone(1)
+        
+        # Смена пояса переносит срабатывание на 9:00 по новому местному времени
+        db.set_user_timezone(1, 'Asia/Tokyo')
+        expected = int(when.replace(tzinfo=zoneinfo.ZoneInfo('Asia/Tokyo')).timestamp())
+        assert reminder['timezone'] == 'Asia/Tokyo'
+        assert reminder['next_fire_at'] == expected
+        
+        # Пояс пользователя сохраняется и применяется к новым напоминаниям
+        db = load_database(tmp)
+        assert db.get_user_timezone(1) == 'Asia/Tokyo'
+        # /start после /timezone дополняет запись пользователя, не теряя пояс
+        db.add_user(1, 'ivan', 'Иван')
+        assert db.users['1']['first_name'] == 'Иван' and 'registered_at' in db.users['1']
+        assert load_database(tmp).users['1']['timezone'] == 'Asia/Tokyo'
+        assert db.add_reminder({'text': 'Ещё', 'datetime': when.isoformat(), 'repeat': 'none', 'days': None, 'user_id': 1})['timezone'] == 'Asia/Tokyo'
+        
+        try:
+            db.set_user_timezone(1, 'Mars/Olympus')
+            assert False, "неизвестный пояс должен отклоняться"
+        except ValueError:
+            pass
+    print("✅ Напоминания срабатывают по местному времени пользователя!")
+
+def test_logging_setup():
+    print("\n🧪 Тестирование настройки логирования...")
+    import io
+    import logging
+    import logging_setup
+    
+    assert logging_setup.parse_levels("scheduler=debug, delivery=WARNING,bad") == {'scheduler': 'DEBUG', 'delivery': 'WARNING'}
+    
+    # JSON-формат включает поля из extra
+    record = logging.LogRecord('scheduler', logging.INFO, __file__, 1, "Tick: due=%s", (3,), None)
+    record.due = 3
+    payload = json.loads(logging_setup.JsonFormatter().format(record))
+    assert payload['message'] == "Tick: due=3" and payload['due'] == 3 and payload['logger'] == 'scheduler'
+    
+    # Планировщик пишет одну строку на такт, а не на каждое напоминание
+    os.environ.setdefault('BOT_TOKEN', '123456:TEST')
+    import main
+    stream = io.StringIO()
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(logging_setup.JsonFormatter())
+    main.scheduler_logger.addHandler(handler)
+    level = main.scheduler_logger.level
+    main.scheduler_logger.setLevel(logging.INFO)
+    try:
+        main.record_tick(100, 5, 4, time.perf_counter())
+        main.record_tick(100, 0, 0, time.perf_counter())  # пустой такт - только DEBUG
+    finally:
+        main.scheduler_logger.removeHandler(handler)
+        main.scheduler_logger.setLevel(level)
+    lines = stream.getvalue().splitlines()
+    assert len(lines) == 1
+    tick = json.loads(lines[0])
+    assert (tick['evaluated'], tick['due'], tick['queued'], tick['failed']) == (100, 5, 4, 1)
+    print("✅ Логирование настраивается по компонентам и агрегируется по тактам!")
+
+def test_metrics():
+    print("\n🧪 Тестирование метрик...")
+    import metrics
+    from aiohttp import web
+    from aiohttp.test_utils import TestClient, TestServer
+    
+    # Выключенные метрики - общая заглушка без состояния
+    disabled = metrics.Registry(enabled=False)
+    assert disabled.counter('x_total', 'x') is metrics.NOOP
+    assert disabled.render() == '\n'
+    
+    registry = metrics.Registry(enabled=True)
+    created = registry.counter('test_created_total', 'Created')
+    lateness = registry.histogram('test_lateness_seconds', 'Lateness', buckets=(1, 5))
+    registry.gauge('test_queue_depth', 'Depth', function=lambda: 7)
+    created.inc()
+    created.inc(2)
+    for value in (0.5, 3, 10):
+        lateness.observe(value)
+    text = registry.render()
+    assert '# TYPE test_created_total counter\ntest_created_total 3' in text
+    assert 'test_lateness_seconds_bucket{le="1"} 1' in text
+    assert 'test_lateness_seconds_bucket{le="5"} 2' in text
+    assert 'test_lateness_seconds_bucket{le="+Inf"} 3' in text
+    assert 'test_lateness_seconds_sum 13.5' in text and 'test_lateness_seconds_count 3' in text
+    assert 'test_queue_depth 7' in text
+    
+    # Очередь отправки считает отправленные сообщения и опоздание относительно плана
+    saved = metrics.registry, metrics.MESSAGES_SENT, metrics.FIRE_LATENESS
+    metrics.registry = registry
+    metrics.MESSAGES_SENT = registry.counter('test_sent_total', 'Sent')
+    metrics.FIRE_LATENESS = registry.histogram('test_fire_lateness_seconds', 'Lateness', buckets=(1, 60))
+    
+    async def send(chat_id, text, **kwargs):
+        pass
+    
+    async def scenario():
+        queue = DeliveryQueue(send, workers=1, global_rate=1000, dead_letter_file=None)
+        queue.submit(1, 'Тест', scheduled_at=time.time() - 30)
+        await queue.stop()
+        
+        app = web.Application()
+        metrics.add_metrics_route(app)
+        client = TestClient(TestServer(app))
+        await client.start_server()
+        try:
+            response = await client.get('/metrics')
+            assert response.status == 200
+            assert response.headers['Content-Type'].startswith('text/plain')
+            return await response.text()
+        finally:
+            await client.close()
+    
+    try:
+        text = asyncio.run(scenario())
+    finally:
+        metrics.registry, metrics.MESSAGES_SENT, metrics.FIRE_LATENESS = saved
+    assert 'test_sent_total 1' in text
+    assert 'test_fire_lateness_seconds_bucket{le="1"} 0' in text
+    assert 'test_fire_lateness_seconds_bucket{le="60"} 1' in text
+    print("✅ Метрики собираются и отдаются в формате Prometheus!")
+
+def test_bulk_import_export():
+    print("\n🧪 Тестирование массового импорта и экспорта...")
+    import io
+    from bulk import import_reminders, write_export
+    
+    when = (datetime.datetime.now() + datetime.timedelta(days=1)).replace(microsecond=0).isoformat()
+    lines = [
+        json.dumps({'text': 'Полить цветы', 'datetime': when, 'repeat': 'daily'}),
+        json.dumps({'text': 'Спортзал', 'datetime': when, 'repeat': 'custom', 'days': [1, 3, 5]}),
+        '{broken json',
+        json.dumps({'text': '', 'datetime': when}),
+        json.dumps({'text': 'Без даты'}),
+        json.dumps({'text': 'Отчёт', 'datetime': when, 'repeat': 'weekly', 'timezone': 'Asia/Tokyo'}),
+    ]
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        db = load_database(tmp)
+        result = import_reminders(db, io.StringIO('\n'.join(lines)), 'jsonl', user_id=7, batch_size=2)
+        assert result.imported == 3
+        assert [line for line, _ in result.errors] == [3, 4, 5]
+        reminders = db.get_user_reminders(7)
+        assert [r['id'] for r in reminders] == [1, 2, 3]
+        assert reminders[2]['timezone'] == 'Asia/Tokyo'
+        assert all(r['next_fire_at'] for r in reminders)
+        
+        # Экспорт в CSV и обратный импорт другому пользователю
+        exported = io.StringIO()
+        assert write_export(db.iter_reminders(7), exported, 'csv') == 3
+        exported.seek(0)
+        result = import_reminders(db, exported, 'csv', user_id=8)
+        assert result.imported == 3 and not result.errors
+        copies = db.get_user_reminders(8)
+        assert [r['days'] for r in copies] == [None, [1, 3, 5], None]
+        
+        # Ограничение числа напоминаний: лишние строки не читаются
+        result = import_reminders(db, io.StringIO('\n'.join(lines)), 'jsonl', user_id=9, limit=2)
+        assert result.imported == 2 and result.stopped == (6, "limit of 2 reminders reached")
+        assert db.reminder_count(9) == 2
+        # Файл не в UTF-8 и испорченный CSV останавливают импорт с номером строки
+        from bulk import format_import_report, open_text
+        binary = io.BytesIO(lines[0].encode('utf-8') + b'\n' + 'Отчёт'.encode('cp1251') + b'\n')
+        result = import_reminders(db, open_text(binary), 'jsonl', user_id=9)
+        assert result.imported == 1 and result.stopped == (2, "file is not valid UTF-8")
+        result = import_reminders(db, io.StringIO(f'text,datetime\nОк,{when}\n"{"x" * 200000}",{when}\n'), 'csv', user_id=9)
+        assert result.imported == 1 and result.stopped[1].startswith('invalid CSV')
+        assert 'Импорт остановлен на строке 3' in format_import_report(result)
+        
+        # Пачка и счётчик id сохраняются на диск вместе
+        db = load_database(tmp)
+        assert len(db.reminders) == 10
+        assert db.add_reminder({'text': 'Ещё', 'datetime': when, 'repeat': 'none', 'days': None, 'user_id': 7})['id'] == 11
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        storage = SqliteStorage(os.path.join(tmp, 'bot.db'))
+        batch = [Reminder.from_dict({'id': i, 'user_id': i % 2, 'text': str(i), 'datetime': when, 'repeat': 'none'})
+                 for i in range(1, 6)]
+        storage.save_reminders(batch, next_id=6)
+        assert storage.load_sequence() == 6
+        assert [r['id'] for r in storage.iter_reminders(1)] == [1, 3, 5]
+        assert len(list(storage.iter_reminders())) == 5
+        storage.close()
+    print("✅ Напоминания импортируются пачками и выгружаются потоково!")
+
+def test_reminder_record():
+    print("\n🧪 Тестирование компактной записи напоминания...")
+    import sys
+    from recurrence import Repeat
+    
+    data = {'text': 'Йога', 'datetime': '2024-03-04T07:30:00', 'repeat': 'custom', 'days': [5, 1, 3],
+            'user_id': 42, 'id': 7, 'created_at': '2024-03-01T12:00:00', 'active': True,
+            'timezone': 'Europe/Berlin', 'next_fire_at': 1709533800, 'source': 'import'}
+    reminder = Reminder.from_dict(data)
+    assert reminder.repeat is Repeat.CUSTOM and reminder.repeat == 'custom'
+    assert reminder.days_mask == 0b0101010
+    # Формат JSON не меняется (дни - по порядку), неизвестные поля сохраняются
+    assert reminder.to_dict() == dict(data, days=[1, 3, 5])
+    assert reminder['datetime'] == '2024-03-04T07:30:00' and reminder.get('source') == 'import'
+    assert reminder.get('last_fired_at', 0) == 0
+    assert next_occurrence(reminder) == next_occurrence(data)
+    
+    # Старые записи со смещением переводятся в местное время пояса напоминания
+    legacy = Reminder.from_dict({'text': 'Старое', 'datetime': '2024-03-04T07:30:00+00:00', 'id': 1,
+                                 'user_id': 1, 'timezone': 'Europe/Moscow'})
+    assert legacy['datetime'] == '2024-03-04T10:30:00' and legacy.repeat is Repeat.NONE
+    
+    # Запись со слотами заметно меньше словаря со строками ISO
+    record_size = sys.getsizeof(reminder) + sys.getsizeof(reminder.text)
+    dict_size = (sys.getsizeof(data) + sum(sys.getsizeof(v) for v in data.values()))
+    assert record_size * 2 < dict_size
+    assert not hasattr(reminder, '__dict__')
+    print("✅ Напоминания хранятся компактно и совместимы с JSON!")
+
+def test_rendering():
+    print("\n🧪 Тестирование сборки сообщений...")
+    
+    reminder = Reminder.from_dict({'id': 1, 'user_id': 1, 'text': 'Купить <молоко> & хлеб', 'repeat': 'custom',
+                                   'days': [1, 3, 5], 'datetime': '2030-03-05T07:05:00', 'active': False})
+    # Текст экранируется один раз при создании, без спецсимволов остаётся той же строкой
+    assert reminder.text_html == 'Купить &lt;молоко&gt; &amp; хлеб'
+    plain = Reminder.from_dict({'text': 'Зарядка', 'datetime': '2030-03-05T07:05:00'})
+    assert plain.text_html is plain.text
+    assert reminder.copy().text_html == reminder.text_html
+    
+    notification = render_notification(reminder, {'first_name': 'Иван <Админ>'})
+    assert '"Купить &lt;молоко&gt; &amp; хлеб"' in notification and 'Иван &lt;Админ&gt;!' in notification
+    assert 'Друг!' in render_notification(plain, {})
+    
+    assert repeat_text(reminder.repeat, reminder.days_mask) == "📌 По дням: Пн, Ср, Пт"
+    assert repeat_text('daily') == "🔄 Ежедневно" and repeat_text('custom', 0) == "⏰ Один раз"
+    card = render_card(3, reminder)
+    assert card == ("\n<b>3.</b> 📝 <b>Купить &lt;молоко&gt; &amp; хлеб</b>\n📅 05.03.2030 ⏰ 07:05 ⏸️\n"
+                    "📌 По дням: Пн, Ср, Пт")
+    # Длинный текст в карточке обрезается: пять карточек помещаются в одно сообщение
+    long_text = Reminder.from_dict({'text': 'Ы' * 1000, 'datetime': '2030-03-05T07:05:00'})
+    assert '<b>' + 'Ы' * 199 + '…</b>' in render_card(1, long_text)
+    assert len('\n'.join(render_card(i, long_text) for i in range(5))) < 4096
+    assert 'Ы' * 99 + '…' in render_archive_entry(dict(long_text.to_dict(), reason='fired'))
+    # Обрезается исходный текст, а не HTML: сущности не разрываются
+    escaped = Reminder.from_dict({'text': '&' * 1000, 'datetime': '2030-03-05T07:05:00'})
+    assert '<b>' + '&amp;' * 199 + '…</b>' in render_card(1, escaped)
+    
+    confirmation = render_confirmation(plain)
+    assert '<b>Дата:</b> 05.03.2030' in confirmation and '<b>Время:</b> 07:05' in confirmation
+    assert '<b>Повторение:</b> ⏰ Один раз' in confirmation
+    print("✅ Тексты сообщений собираются из кэша и экранируются!")
+
+def test_snooze():
+    print("\n🧪 Тестирование кнопок «Отложить» и «Готово»...")
+    
+    # «Завтра» - то же время по местным часам, даже через переход на летнее время
+    berlin = zoneinfo.ZoneInfo('Europe/Berlin')
+    now = datetime.datetime(2024, 3, 30, 12, 0, tzinfo=berlin).timestamp()
+    assert snooze_time('10m', now) == now + 600 and snooze_time('1h', now) == now + 3600
+    assert snooze_time('tomorrow', now, 'Europe/Berlin') == datetime.datetime(2024, 3, 31, 12, 0, tzinfo=berlin).timestamp()
+    
+    class StubQueue:
+        def __init__(self):
+            self.sent = []
+            self.stats = {'sent': 0, 'failed': 0}
+        
+        def submit(self, chat_id, text, scheduled_at=None, **kwargs):
+            self.sent.append((chat_id, kwargs['reply_markup']))
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        scheduler = ReminderScheduler()
+        db = load_database(tmp, scheduler=scheduler)
+        import main
+        saved = main.db, main.reminder_scheduler, main.delivery_queue
+        main.db, main.reminder_scheduler, main.delivery_queue = db, scheduler, StubQueue()
+        try:
+            when = datetime.datetime.now() - datetime.timedelta(seconds=30)
+            reminder = db.add_reminder({'text': 'Позвонить', 'datetime': when.isoformat(), 'repeat': 'none', 'user_id': 1})
+            asyncio.run(main.check_reminders())
+            assert not reminder.active and len(scheduler) == 0
+            (chat_id, markup), = main.delivery_queue.sent
+            callbacks = [button.callback_data for row in markup.inline_keyboard for button in row]
+            assert callbacks == [f'snooze_{reminder.id}_10m', f'snooze_{reminder.id}_1h',
+                                 f'snooze_{reminder.id}_tomorrow', f'done_{reminder.id}']
+            
+            # Отложенное уведомление - таймер в планировщике, хранилище не меняется
+            journal_size = os.path.getsize(db.storage.journal_file)
+            fire_at = db.snooze(reminder, '10m')
+            assert scheduler.next_fire_at() == fire_at and len(scheduler) == 1
+            assert os.path.getsize(db.storage.journal_file) == journal_size
+            # Повторное нажатие переставляет таймер, а не добавляет второй
+            db.snooze(reminder, '1h')
+            assert len(scheduler) == 1
+            
+            # Срабатывание таймера присылает уведомление, но не трогает само напоминание
+            scheduler.schedule(main.snooze_key(reminder.id), time.time() - 1, reminder)
+            last_fired_at = reminder.last_fired_at
+            asyncio.run(main.check_reminders())
+            assert len(main.delivery_queue.sent) == 2 and reminder.last_fired_at == last_fired_at
+            assert len(scheduler) == 0 and os.path.getsize(db.storage.journal_file) == journal_size
+            
+            # «Готово» и удаление отменяют отложенное уведомление
+            db.snooze(reminder, 'tomorrow')
+            db.cancel_snooze(reminder.id)
+            assert len(scheduler) == 0
+            db.snooze(reminder, '10m')
+            db.delete_reminder(reminder.id, 1)
+            assert len(scheduler) == 0
+        finally:
+            main.db, main.reminder_scheduler, main.delivery_queue = saved
+    print("✅ Уведомления откладываются без записи в хранилище!")
+
+def test_retention():
+    print("\n🧪 Тестирование архивации истёкших напоминаний...")
+    from rendering import render_archive_entry
+    from retention import expiry_reason
+    
+    day = 24 * 3600
+    now = time.time()
+    with tempfile.TemporaryDirectory() as tmp:
+        db = load_database(tmp, scheduler=ReminderScheduler())
+        past = (datetime.datetime.now() - datetime.timedelta(days=40)).isoformat()
+        fired = db.add_reminder({'text': 'Отправлено <давно>', 'datetime': past, 'repeat': 'none', 'user_id': 1})
+        db.mark_fired(fired, now - 40 * day, now - 40 * day)
+        recent = db.add_reminder({'text': 'Отправлено вчера', 'datetime': past, 'repeat': 'none', 'user_id': 1})
+        db.mark_fired(recent, now - day, now - day)
+        paused = db.add_reminder({'text': 'На паузе', 'datetime': past, 'repeat': 'daily', 'user_id': 2})
+        db.toggle_reminder(paused.id, 2)
+        paused.paused_at = int(now - 100 * day)
+        live = db.add_reminder({'text': 'Живое', 'datetime': past, 'repeat': 'daily', 'user_id': 2})
+        
+        assert expiry_reason(fired, now, 30 * day, 0) == 'fired'
+        assert expiry_reason(recent, now, 30 * day, 0) is None
+        # По умолчанию приостановленные не архивируются (TTL 0)
+        assert expiry_reason(paused, now, 30 * day, 0) is None
+        assert expiry_reason(paused, now, 30 * day, 90 * day) == 'paused'
+        assert expiry_reason(live, now, 1, 1) is None
+        
+        stats = db.archive_expired(now, fired_ttl=30 * day, paused_ttl=90 * day)
+        assert stats['archived'] == 2 and stats['fired'] == 1 and stats['paused'] == 1
+        assert stats['reclaimed_bytes'] == os.path.getsize(db.storage.archive_file)
+        assert sorted(r.id for r in db.reminders) == [recent.id, live.id]
+        assert db.get_reminder(paused.id, 2) is None and db.get_user_reminders(2) == [live]
+        assert db.archive_expired(now, fired_ttl=30 * day, paused_ttl=90 * day)['archived'] == 0
+        
+        # Архив доступен для истории, рабочий набор после перезапуска - без архивных записей
+        history = list(db.storage.iter_archive(1))
+        assert [(r['id'], r['reason']) for r in history] == [(fired.id, 'fired')]
+        assert 'Отправлено &lt;давно&gt;' in render_archive_entry(history[0])
+        # /history читает архив с конца, блоками, в пуле потоков
+        import storage as storage_module
+        for i in range(300):
+            db.storage.archive_reminders([(Reminder.from_dict({'id': 1000 + i, 'user_id': 1 + i % 3, 'text': f'Дело {i}',
+                                                               'datetime': past}), 'fired')], int(now))
+        block, storage_module._ARCHIVE_BLOCK = storage_module._ARCHIVE_BLOCK, 1000
+        try:
+            latest = asyncio.run(db.storage.recent_archive(1, 5))
+            assert [r['id'] for r in latest] == [1297, 1294, 1291, 1288, 1285]
+            assert [r['id'] for r in asyncio.run(db.storage.recent_archive(1, 1000))][-1] == fired.id
+            assert asyncio.run(db.storage.recent_archive(4, 5)) == []
+        finally:
+            storage_module._ARCHIVE_BLOCK = block
+        db.storage.close()
+        assert sorted(r.id for r in load_database(tmp).reminders) == [recent.id, live.id]
+        
+        storage = SqliteStorage(os.path.join(tmp, 'test.db'))
+        storage.save_reminders([fired, live])
+        size = storage.archive_reminders([(fired, 'fired')], int(now))
+        assert size > 0 and [r.id for r in storage.iter_reminders()] == [live.id]
+        assert [r['id'] for r in storage.iter_archive(1)] == [fired.id] and list(storage.iter_archive(2)) == []
+        assert [r['id'] for r in asyncio.run(storage.recent_archive(1, 20))] == [fired.id]
+        storage.close()
+    print("✅ Истёкшие напоминания уходят в архив и доступны в истории!")
+
 if __name__ == "__main__":
     print("🚀 Запуск тестов Napominalkin Bot")
     print("=" * 50)
@@ -113,6 +1177,32 @@ if __name__ == "__main__":
     test_database()
     test_reminder_logic()
     test_notification_message()
+    test_scheduler_queue()
+    test_recurrence()
+    test_sqlite_storage()
+    test_json_write_coalescing()
+    test_journal_recovery()
+    test_flusher_shutdown()
+    test_downtime_report()
+    test_database_indexes()
+    test_reminder_ids()
+    test_token_bucket()
+    test_delivery_queue()
+    test_synthetic_reminders()
+    test_webhook_app()
+    test_shard_leases()
+    test_shared_database()
+    test_sqlite_database()
+    test_reminders_page()
+    test_user_timezone()
+    test_logging_setup()
+    test_metrics()
+    test_bulk_import_export()
+    test_reminder_record()
+    test_rendering()
+    test_snooze()
+    test_retention()
+    test_scheduler_errors()
     
     print("\n" + "=" * 50)
     print("🎉 Все тесты пройдены успешно!")